@@ -1,17 +1,155 @@
-import json
-from player import Player
+import random
 import logging
+import odds
+from enums import Moves, Phases
+from moves import Move
+from player import Player
 
 log = logging.getLogger("MunchkinServer")
 
+# A policy decides what a bot does next. Its choose is given the bot's valid moves as (card, move_type, target)
+# options and returns one of them, or None to ready up.
+
+class RandomPolicy(object):
+	def __init__(self, rng=random, play_chance=0.5):
+		self.rng, self.play_chance = rng, play_chance
+
+	def choose(self, game, player, options):
+		if options and self.rng.random() < self.play_chance:
+			return self.rng.choice(options)
+
+class GreedyPolicy(object):
+	"""Plays whatever adds the most strength right now: to itself, or to the monsters another player is fighting."""
+
+	def gain(self, game, player, option):
+		card, move_type, target = option
+
+		if move_type == Moves.CARRY:
+			return card.bonus_on_player(player) if card.can_equip(player) else 0
+
+		if move_type == Moves.PLAY and game.phase == Phases.COMBAT:
+			fighting = player in game.combat.players
+			if (target == 'combat_players') == fighting:
+				return card.bonus
+
+		return 0
+
+	def choose(self, game, player, options):
+		if options:
+			gains = [self.gain(game, player, option) for option in options]
+			best = max(range(len(options)), key=gains.__getitem__)
+			if gains[best] > 0:
+				return options[best]
+
+class LookaheadPolicy(GreedyPolicy):
+	"""Like GreedyPolicy, but only spends combat cards when they change who wins the fight."""
+
+	def gain(self, game, player, option):
+		card, move_type, target = option
+
+		if move_type == Moves.PLAY and game.phase == Phases.COMBAT:
+			margin = game.combat.margin()
+			fighting = player in game.combat.players
+
+			if fighting and target == 'combat_players':
+				return card.bonus if margin <= 0 < margin + card.bonus else 0
+			if not fighting and target == 'combat_monsters':
+				return card.bonus if margin - card.bonus <= 0 < margin else 0
+			return 0
+
+		return super().gain(game, player, option)
+
+class OddsPolicy(GreedyPolicy):
+	"""Like GreedyPolicy, but scores combat cards by how much they raise its chance of the outcome it wants, from
+	the rollouts odds.win_probability uses for the combat status.
+	"""
+	rollouts = 512
+
+	def gain(self, game, player, option):
+		card, move_type, target = option
+
+		if move_type == Moves.PLAY and game.phase == Phases.COMBAT:
+			# Seeded, so a game's seed still decides everything its bots do.
+			rng = odds.seeded_rng(game.seed, game.action_number, player.id)
+			before, after = odds.play_odds(game, player, card, target, self.rollouts, rng=rng)
+			return after - before if player in game.combat.players else before - after
+
+		return super().gain(game, player, option)
+
+class BotRunner(object):
+	"""Collects the bots that have something new to look at, and runs all of a loop's decisions in one callback."""
+
+	def __init__(self):
+		# IOLoop -> bots waiting on it. The inner dicts are ordered sets.
+		self.pending = {}
+
+	def wake(self, bot):
+		io_loop = bot.game.io_loop
+
+		if io_loop not in self.pending:
+			self.pending[io_loop] = {}
+			io_loop.add_callback(self.run, io_loop)
+
+		self.pending[io_loop][bot] = None
+
+	def run(self, io_loop):
+		for bot in self.pending.pop(io_loop):
+			bot.decide()
+
+runner = BotRunner()
+
 class AI(Player):
-	def __init__(self, name, connection):
+	"""A bot that plays in-process, reading the game directly rather than the messages it is sent."""
+
+	def __init__(self, name, game, policy=None):
 		super().__init__(name, AIConnection(self))
+		self.game = game
+		self.policy = policy or OddsPolicy()
+		# Game state the last decision was made in, so the bot acts once per change rather than once per message.
+		self.decided = None
+
+	def options(self):
+		game = self.game
+		options = []
+
+		for card_id, moves in game.get_valid_moves(self).items():
+			if card_id is None:
+				continue
+
+			card = game.card_from_id(card_id)
+			for move_type, targets in moves.items():
+				for target in targets:
+					if isinstance(target, dict):
+						target = game.card_from_id(target['id'])
+					options.append((card, move_type, target))
+
+		return options
+
+	def decide(self):
+		game = self.game
+		state = (game.action_number, game.phase, game.current_player)
+
+		if self.ready or game.phase is None or state == self.decided or self not in game.players:
+			return
+		self.decided = state
+
+		choice = self.policy.choose(game, self, self.options())
+
+		if choice is None:
+			game.submit(game.ready, self)
+		else:
+			card, move_type, target = choice
+			game.submit(self.play, Move(game, move_type, self, card, target))
 
+	def play(self, move):
+		# Someone else may have changed the game since the bot decided.
+		if self.game.is_valid(move):
+			self.game.play_move(move)
 
 class AIConnection(object):
 	def __init__(self, player):
 		self.player = player
 
-	def write_message(self, message):
-		msg = json.loads(message)
\ No newline at end of file
+	def send(self, message):
+		# Anything the game sends might change what the bot should do.
+		runner.wake(self.player)
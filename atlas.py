@@ -0,0 +1,62 @@
+"""Pack card art into sprite atlases.
+
+Every image the card catalogue uses is scaled into one cell of a grid, and the grid is saved once per resolution
+tier, so a client loads a single image for every card it shows. Cells are CELL_WIDTH x CELL_HEIGHT at 1x, the size
+of .card in main.css, and sit in the same place in every tier, so one map of cells serves them all.
+
+Needs Pillow. build_assets.py runs this when it is installed.
+"""
+import io
+import os
+import math
+
+from PIL import Image
+
+import cards
+
+CELL_WIDTH, CELL_HEIGHT = 65, 100
+SCALES = (1, 2, 3)
+JPEG_QUALITY = 85
+# Shows through anywhere art doesn't cover, the same as .card's background-color.
+BACKGROUND = (0xff, 0xcc, 0xaa)
+
+def card_images():
+	"""Every image path the catalogue uses, in a stable order."""
+	version, types = cards.Card.catalogue()
+	return sorted({info['image'] for info in types.values()})
+
+def layout(images):
+	"""(columns, rows, image path -> [column, row]) for a grid about as wide as it is tall."""
+	columns = max(1, math.ceil(math.sqrt(len(images))))
+	rows = max(1, math.ceil(len(images) / columns))
+	return columns, rows, {image: [i % columns, i // columns] for i, image in enumerate(images)}
+
+def render(root, columns, rows, cells, scale):
+	"""The atlas for one tier, as jpeg bytes."""
+	width, height = CELL_WIDTH * scale, CELL_HEIGHT * scale
+	sheet = Image.new('RGB', (columns * width, rows * height), BACKGROUND)
+
+	for image, (column, row) in cells.items():
+		with Image.open(os.path.join(root, image)) as art:
+			sheet.paste(art.convert('RGB').resize((width, height), Image.LANCZOS), (column * width, row * height))
+
+	out = io.BytesIO()
+	sheet.save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+	return out.getvalue()
+
+def build(root):
+	"""(map, [(scale, jpeg bytes)]) for every card image under root.
+
+	The caller names the tier images, and adds them to the map's tiers as {'scale', 'image'}.
+	"""
+	columns, rows, cells = layout(card_images())
+
+	atlas_map = {
+		'columns': columns,
+		'rows': rows,
+		'cell': [CELL_WIDTH, CELL_HEIGHT],
+		'cells': cells,
+		'tiers': [],
+	}
+
+	return atlas_map, [(scale, render(root, columns, rows, cells, scale)) for scale in SCALES]
@@ -0,0 +1,195 @@
+"""Build the web client's assets for serving.
+
+Minifies the scripts and stylesheets index.html uses, names each after a hash of its contents and rewrites
+index.html to point at the new names. Every built file gets a gzip variant, and a brotli one if the brotli package
+is installed. The manifest lists what was built, and temp.FileHandler serves from it whenever it exists: the
+smallest variant a client accepts, with hashed names cached forever since new contents means a new name.
+
+rjsmin and rcssmin do the minifying when they are installed. Without them scripts only lose indentation, blank
+lines and whole line comments, and stylesheets lose comments and extra whitespace.
+
+With Pillow installed it also packs the card art into sprite atlases, see atlas.py, and lists their map in the
+manifest as atlas.json.
+
+Run with `python build_assets.py` whenever the client or the card art changes.
+"""
+import os
+import re
+import gzip
+import json
+import hashlib
+
+import tornado.options
+
+from temp import ROOT, BUILD_DIR, MANIFEST, ENCODINGS
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+try:
+	import atlas
+except ImportError:
+	atlas = None
+
+try:
+	import rjsmin
+except ImportError:
+	rjsmin = None
+
+try:
+	import rcssmin
+except ImportError:
+	rcssmin = None
+
+# src and href attributes in index.html.
+REFERENCE = re.compile(r'''\b(src|href)=(["'])([^"']+)\2''')
+
+def strip_comment_lines(lines):
+	"""Drop lines that are entirely // or /* */ comments, leaving comments that share a line with code alone."""
+	kept = []
+	comment = None
+
+	for line in lines:
+		if comment is not None:
+			comment.append(line)
+			if '*/' in line:
+				# Only drop the comment if nothing follows it on its last line.
+				if not line.endswith('*/'):
+					kept.extend(comment)
+				comment = None
+		elif line.startswith('//'):
+			continue
+		elif line.startswith('/*'):
+			if '*/' in line:
+				if not line.endswith('*/'):
+					kept.append(line)
+			else:
+				comment = [line]
+		else:
+			kept.append(line)
+
+	return kept + (comment or [])
+
+def minify_js(text):
+	if rjsmin is not None:
+		return rjsmin.jsmin(text)
+
+	# Newlines stay, so automatic semicolon insertion sees the same statements.
+	lines = [line.strip() for line in text.splitlines()]
+	return '\n'.join(line for line in strip_comment_lines(lines) if line) + '\n'
+
+def minify_css(text):
+	if rcssmin is not None:
+		return rcssmin.cssmin(text)
+
+	text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+	text = re.sub(r'\s+', ' ', text)
+	return re.sub(r'\s*([{};,>])\s*', r'\1', text).strip() + '\n'
+
+MINIFIERS = {
+	'.js': minify_js,
+	'.css': minify_css,
+}
+
+def compress(encoding, data):
+	if encoding == 'br':
+		return brotli.compress(data) if brotli else None
+	if encoding == 'gzip':
+		return gzip.compress(data, 9, mtime=0)
+
+def read(path):
+	with open(os.path.join(ROOT, path), encoding='utf-8') as f:
+		return f.read()
+
+def write(name, data):
+	with open(os.path.join(BUILD_DIR, name), 'wb') as f:
+		f.write(data)
+
+# A compressed variant has to save this much to be worth a Content-Encoding. Images barely compress at all.
+MIN_SAVING = 0.05
+
+def emit(files, name, data, immutable):
+	"""Write name and whichever compressed variants of it are worth having, and list them in files."""
+	write(name, data)
+	encodings = []
+
+	for encoding, suffix in ENCODINGS:
+		compressed = compress(encoding, data)
+		if compressed is not None and len(compressed) < len(data) * (1 - MIN_SAVING):
+			write(name + suffix, compressed)
+			encodings.append(encoding)
+
+	files[name] = {'encodings': encodings, 'immutable': immutable}
+
+def content_name(stem, data, ext):
+	return '%s.%s%s' % (stem, hashlib.sha1(data).hexdigest()[:10], ext)
+
+def build_atlas(files):
+	"""Emit the card art atlases and their map. Returns the map's name."""
+	atlas_map, tiers = atlas.build(ROOT)
+
+	for scale, data in tiers:
+		name = content_name('cards.%dx' % scale, data, '.jpg')
+		emit(files, name, data, immutable=True)
+		atlas_map['tiers'].append({'scale': scale, 'image': name})
+
+	data = json.dumps(atlas_map, sort_keys=True).encode('utf-8')
+	name = content_name('atlas', data, '.json')
+	emit(files, name, data, immutable=True)
+	return name
+
+def build():
+	"""Build everything index.html uses into BUILD_DIR. Returns the manifest."""
+	os.makedirs(BUILD_DIR, exist_ok=True)
+	files = {}
+	# Source path -> built name.
+	sources = {}
+
+	def hashed(match):
+		attr, quote, source = match.groups()
+		stem, ext = os.path.splitext(source)
+
+		if ext not in MINIFIERS:
+			return match.group(0)
+
+		if source not in sources:
+			data = MINIFIERS[ext](read(source)).encode('utf-8')
+			name = content_name(os.path.basename(stem), data, ext)
+			emit(files, name, data, immutable=True)
+			sources[source] = name
+
+		return '%s=%s%s%s' % (attr, quote, sources[source], quote)
+
+	if atlas is not None:
+		sources['atlas.json'] = build_atlas(files)
+
+	html = REFERENCE.sub(hashed, read('index.html'))
+	# index.html keeps its name, so clients have to check it for changes every time.
+	emit(files, 'index.html', html.encode('utf-8'), immutable=False)
+
+	manifest = {'sources': sources, 'files': files}
+	write(os.path.basename(MANIFEST), json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+
+	# Drop whatever earlier builds left behind.
+	built = {os.path.basename(MANIFEST)}
+	for name, info in files.items():
+		built.add(name)
+		built.update(name + suffix for encoding, suffix in ENCODINGS if encoding in info['encodings'])
+
+	for name in os.listdir(BUILD_DIR):
+		if name not in built:
+			os.remove(os.path.join(BUILD_DIR, name))
+
+	return manifest
+
+if __name__ == '__main__':
+	tornado.options.parse_command_line()
+
+	manifest = build()
+	for name, info in sorted(manifest['files'].items()):
+		sizes = ['%d' % os.path.getsize(os.path.join(BUILD_DIR, name))]
+		sizes += ['%s %d' % (encoding, os.path.getsize(os.path.join(BUILD_DIR, name + suffix)))
+			for encoding, suffix in ENCODINGS if encoding in info['encodings']]
+		print("%-32s %s" % (name, ', '.join(sizes)))
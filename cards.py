@@ -1,14 +1,52 @@
 import json
-from enums import Moves, Phases
+import hashlib
+from collections import defaultdict
+from enums import Moves, Phases, Targets
 
 IMAGE_ROOT = 'res/'
 
-class Card(object):
-	def __init__(self, game, deck, id):
-		self.id = id
+TARGET_ORDER = [Targets.NONE, Targets.CARD, Targets.COMBAT]
+
+class CardType(type):
+	"""Gives every card class empty __slots__ unless it declares its own, so no card instance carries a __dict__.
+
+	Also numbers the classes in the order they are defined, which is the type id clients know them by.
+	"""
+	classes = []
+
+	def __new__(mcs, name, bases, namespace):
+		namespace.setdefault('__slots__', ())
+		namespace['type_id'] = len(mcs.classes)
+		cls = super().__new__(mcs, name, bases, namespace)
+		mcs.classes.append(cls)
+		return cls
+
+class Card(object, metaclass=CardType):
+	# key is the card's stable identity within the game. Clients only ever see id, see Game.public_id.
+	__slots__ = ('key', 'in_hand', 'deck', 'game', 'zone', 'epoch', '_id', '_id_epoch')
+
+	# (move, phases, target kinds) that this class adds on top of its parents.
+	# phases of None means any phase. can_play still has the final say, this only
+	# has to be a superset of what it accepts.
+	plays = ()
+
+	_candidates = {}
+	# (version, type id -> static info), see catalogue.
+	_catalogue = None
+
+	def __init__(self, game, deck, key):
+		self.key = key
 		self.in_hand = True
 		self.deck = deck
 		self.game = game
+		self.zone = None
+		# The deck shuffle count the card's id was fixed at, or None while it is in the deck.
+		self.epoch = None
+		self._id = self._id_epoch = None
+
+	@property
+	def id(self):
+		return self.game.public_id(self)
 
 	def discard(self):
 		self.game.discard(self)
@@ -16,13 +54,60 @@ class Card(object):
 	def can_play(self, move, target, phase, in_turn):
 		return False
 
-	def info(self, player=None):
+	@classmethod
+	def candidate_targets(cls, phase, move):
+		"""Target kinds that could make move playable in phase for this class."""
+		key = (cls, phase)
+		if key not in Card._candidates:
+			moves = defaultdict(set)
+			for klass in cls.__mro__:
+				for play_move, phases, kinds in klass.__dict__.get('plays', ()):
+					if phases is None or phase in phases:
+						moves[play_move].update(kinds)
+
+			Card._candidates[key] = {
+				play_move: [kind for kind in TARGET_ORDER if kind in kinds]
+				for play_move, kinds in moves.items()
+			}
+
+		return Card._candidates[key].get(move, ())
+
+	@classmethod
+	def static_info(cls):
+		"""Info shared by every card of this class, from class attributes. Extend this rather than info where possible."""
 		return {
-			'id': self.id,
-			'name': self.name,
-			'image': IMAGE_ROOT+self.image,
+			'name': cls.name,
+			'image': IMAGE_ROOT+cls.image,
 		}
 
+	@staticmethod
+	def catalogue():
+		"""(version, type id -> static info) for every card class that can be shown.
+
+		Clients fetch this once and look cards up in it by type, so messages only carry what can change. The
+		version is a hash of the contents, so it can be cached for as long as it exists.
+		"""
+		if Card._catalogue is None:
+			types = {cls.type_id: cls.static_info() for cls in CardType.classes if hasattr(cls, 'image')}
+			version = hashlib.sha1(json.dumps(types, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+			Card._catalogue = (version, types)
+
+		return Card._catalogue
+
+	def info(self, player=None):
+		"""The card's id and type id, plus anything about it that isn't in the catalogue."""
+		return {'id': self.id, 'type': self.type_id}
+
+class HiddenCard(object):
+	"""A face down stand-in for a card, showing only its id and the back of its deck's card class."""
+	__slots__ = ('id', 'back')
+
+	def __init__(self, id, back):
+		self.id, self.back = id, back
+
+	def info(self, player=None):
+		return {'id': self.id, 'type': self.back.type_id}
+
 class DoorCard(Card):
 	name = "Door Card"
 	image = "room_back.png"
@@ -32,6 +117,8 @@ class TreasureCard(Card):
 	image = "treasure_back.png"
 
 class Monster(DoorCard):
+	plays = ((Moves.FIGHT, None, (Targets.NONE,)),)
+
 	level = 1
 
 	level_ups = 1
@@ -54,15 +141,22 @@ class Monster(DoorCard):
 		return super().can_play(move, target, phase, in_turn) or \
 		    (move == Moves.FIGHT and self.in_hand and in_turn and target == None)
 
+	@classmethod
+	def static_info(cls):
+		d = super().static_info()
+		d['level'] = cls.level
+		return d
+
 	def info(self, player=None):
 		d = super().info(player)
-		d['level'] = self.level
 		if player:
 			d['bonus'] = self.bonus(player)
 
 		return d
 
 class Item(TreasureCard):
+	plays = ((Moves.CARRY, None, (Targets.NONE,)),)
+
 	name = "Unimplemented Item"
 	bonus = 0
 	value = None
@@ -79,12 +173,15 @@ class Item(TreasureCard):
 		return super().can_play(move, target, phase, in_turn) or \
 		    (move == Moves.CARRY and self.in_hand and in_turn and target == None)
 
-	def info(self, player=None):
-		d = super().info(player)
-		d['bonus'] = self.bonus
+	@classmethod
+	def static_info(cls):
+		d = super().static_info()
+		d['bonus'] = cls.bonus
 		return d
 
 class CombatOneShot(Item):
+	plays = ((Moves.PLAY, (Phases.COMBAT,), (Targets.COMBAT,)),)
+
 	def can_equip(self, player):
 		return False
 
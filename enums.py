@@ -23,4 +23,11 @@ Moves = enum(
 	'GIVE',
 	'DONE',
 	'WAIT'
+)
+
+# Kinds of target a move can be aimed at, in the order they are offered to the client.
+Targets = enum(
+	'NONE',
+	'CARD',
+	'COMBAT',
 )
\ No newline at end of file
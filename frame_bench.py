@@ -0,0 +1,176 @@
+"""Check websocket.FrameParser against decode_hybi, and measure both on bursts of small frames.
+
+First this fuzzes: random streams of masked and unmasked frames, fragmented messages with pings between their
+fragments and a close frame, split into random reads, have to come out of the parser exactly as they come out of
+decode_hybi driven the way recv_frames used to drive it, with fragments joined. Then it times reading one burst
+of many small frames both ways, the old way slicing the remaining buffer once per frame.
+
+test_frames.py runs the comparison on its own, on a fixed seed.
+
+Run with `python frame_bench.py --rounds=2000 --frames=1000,10000`.
+"""
+import io
+import os
+import time
+import random
+import struct
+import contextlib
+
+import tornado.options
+
+import websocket
+
+tornado.options.define('rounds', default=2000, help="Random streams to compare the two decoders on")
+tornado.options.define('fuzz_seed', default=None, type=int, help="Seed for the random streams")
+tornado.options.define('frames', default=[1000, 10000], multiple=True, type=int,
+	help="Burst sizes, in frames, to time both decoders on")
+tornado.options.define('size', default=16, help="Payload bytes in each frame of a burst")
+
+WebSocketServer = websocket.WebSocketServer
+
+def encode(opcode, payload, fin=True, mask=True):
+	"""A client's frame: masked unless told otherwise."""
+	b1 = (0x80 if fin else 0) | opcode
+	b2 = 0x80 if mask else 0
+
+	if len(payload) < 126:
+		header = struct.pack('>BB', b1, b2 | len(payload))
+	elif len(payload) < 65536:
+		header = struct.pack('>BBH', b1, b2 | 126, len(payload))
+	else:
+		header = struct.pack('>BBQ', b1, b2 | 127, len(payload))
+
+	if not mask:
+		return header + payload
+
+	key = os.urandom(4)
+	return header + key + bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+
+def old_decode(reads):
+	"""Every frame in reads, as recv_frames found them before FrameParser, as (opcode, fin, payload, close)."""
+	frames = []
+	part = b''
+
+	for buf in reads:
+		buf = part + buf
+		part = b''
+
+		while buf:
+			frame = WebSocketServer.decode_hybi(buf)
+			if frame['payload'] is None:
+				if frame['left'] > 0:
+					part = buf[-frame['left']:]
+				break
+
+			close = (frame['close_code'], frame['close_reason']) if frame['opcode'] == 0x8 else None
+			frames.append((frame['opcode'], frame['fin'], bytes(frame['payload']), close))
+			if close:
+				return frames
+
+			buf = buf[-frame['left']:] if frame['left'] else b''
+
+	return frames
+
+def join_fragments(frames):
+	"""Old frames with each fragmented message joined into one, as (opcode, payload, close)."""
+	joined = []
+	opcode, fragments = None, []
+
+	for frame_opcode, fin, payload, close in frames:
+		if frame_opcode >= 0x8:
+			joined.append((frame_opcode, payload, close))
+			continue
+
+		if frame_opcode:
+			opcode = frame_opcode
+		fragments.append(payload)
+		if fin:
+			joined.append((opcode, b''.join(fragments), None))
+			opcode, fragments = None, []
+
+	return joined
+
+def new_decode(reads):
+	parser = websocket.FrameParser()
+	messages = []
+
+	for buf in reads:
+		parser.feed(buf)
+		for frame in parser.frames():
+			close = (frame.close_code, frame.close_reason) if frame.opcode == 0x8 else None
+			messages.append((frame.opcode, frame.payload, close))
+			if close:
+				return messages
+
+	return messages
+
+def random_payload(rng):
+	size = rng.choice([0, 1, 3, 4, 5, 125, 126, 127, 1000, 65535, 65536, 70000])
+	if rng.random() < 0.5:
+		size = rng.randrange(0, 300)
+	return os.urandom(size)
+
+def random_stream(rng):
+	"""Bytes of a random valid stream from a client, ending with a close frame."""
+	frames = []
+
+	for i in range(rng.randrange(1, 12)):
+		mask = rng.random() < 0.9
+		opcode = rng.choice([0x1, 0x2])
+
+		if rng.random() < 0.3:
+			count = rng.randrange(2, 5)
+			for j in range(count):
+				frames.append(encode(opcode if j == 0 else 0x0, random_payload(rng), j == count - 1, mask))
+				if rng.random() < 0.3:
+					frames.append(encode(rng.choice([0x9, 0xa]), os.urandom(rng.randrange(0, 126))))
+		else:
+			frames.append(encode(opcode, random_payload(rng), True, mask))
+
+	reason = os.urandom(rng.choice([0, 1, 2, 10]))
+	frames.append(encode(0x8, struct.pack('>H', rng.choice([1000, 1001, 1011])) + reason if rng.random() < 0.8 else b''))
+	# Whatever comes after a close has to be ignored.
+	frames.append(encode(0x1, b'after close'))
+	return b''.join(frames)
+
+def random_reads(rng, data):
+	"""data split into reads at random points, short streams sometimes a byte at a time."""
+	cuts = sorted(rng.randrange(0, len(data) + 1) for i in range(rng.randrange(0, 20)))
+	# Byte at a time reads are quadratic for the old decoder, so only short streams get them.
+	if len(data) < 4096 and rng.random() < 0.2:
+		cuts = range(len(data))
+	return [data[a:b] for a, b in zip([0] + list(cuts), list(cuts) + [len(data)])]
+
+def fuzz(rounds, seed):
+	rng = random.Random(seed)
+
+	for i in range(rounds):
+		reads = random_reads(rng, random_stream(rng))
+		# decode_hybi prints every unmasked frame.
+		with contextlib.redirect_stdout(io.StringIO()):
+			expected = join_fragments(old_decode(reads))
+		got = new_decode(reads)
+
+		if got != expected:
+			raise AssertionError("Round %d decoded differently:\n%r\n%r" % (i, expected[:5], got[:5]))
+
+def time_burst(decode, reads):
+	start = time.perf_counter()
+	decode(reads)
+	return time.perf_counter() - start
+
+if __name__ == '__main__':
+	tornado.options.parse_command_line()
+	options = tornado.options.options
+
+	fuzz(options.rounds, options.fuzz_seed)
+	print("%d random streams decoded the same both ways" % options.rounds)
+
+	for count in options.frames:
+		frame = encode(0x2, os.urandom(options.size))
+		# The whole burst arrives in one read, the worst case for re-slicing what's left after every frame.
+		reads = [frame * count]
+
+		old = time_burst(old_decode, reads)
+		new = time_burst(new_decode, reads)
+		print("%6d frames: decode_hybi %8.1f ms, FrameParser %8.1f ms" % (count, old * 1000, new * 1000))
@@ -0,0 +1,190 @@
+"""Append-only game logs, so games survive a restart.
+
+Each game logs every action it accepts (joins, leaves, start, readies and moves), one json list per line. Every so
+often, between actions, it starts a new segment file that opens with a snapshot of the whole game, its rng state
+included, and deletes the old one. Recovering a game is restoring the latest snapshot and replaying what follows
+it, which draws the same cards the game drew the first time.
+
+All games share one writer thread, which writes whatever has queued up and then fsyncs each file it touched
+once, so many actions share an fsync and the game never waits on the disk.
+"""
+import os
+import json
+import queue
+import logging
+import threading
+
+log = logging.getLogger("MunchkinServer")
+
+class LogWriter(threading.Thread):
+	def __init__(self):
+		super().__init__(daemon=True)
+		self.queue = queue.Queue()
+		self.files = {}
+		self.start()
+
+	def write(self, game_log, line):
+		self.queue.put((game_log, line))
+
+	def new_segment(self, game_log, path, line, previous):
+		self.queue.put((game_log, (path, line, previous)))
+
+	def close(self):
+		"""Write everything queued so far and stop."""
+		self.queue.put(None)
+		self.join()
+
+	def run(self):
+		running = True
+
+		while running:
+			batch = [self.queue.get()]
+			while True:
+				try:
+					batch.append(self.queue.get_nowait())
+				except queue.Empty:
+					break
+
+			dirty = set()
+			for item in batch:
+				if item is None:
+					running = False
+					continue
+
+				game_log, line = item
+				if isinstance(line, tuple):
+					self.rotate(game_log, *line)
+					dirty.discard(game_log)
+				else:
+					self.files[game_log].write(line)
+					dirty.add(game_log)
+
+			for game_log in dirty:
+				self.sync(self.files[game_log])
+
+		for f in self.files.values():
+			f.close()
+
+	def sync(self, f):
+		f.flush()
+		os.fsync(f.fileno())
+
+	def rotate(self, game_log, path, line, previous):
+		if game_log in self.files:
+			# Until the new segment is on disk, recovery falls back to this one, so it has to be complete.
+			old = self.files.pop(game_log)
+			self.sync(old)
+			old.close()
+
+		new = self.files[game_log] = open(path, 'w')
+		new.write(line)
+		self.sync(new)
+
+		# The new segment is safely on disk, so the previous one is no longer needed.
+		if os.path.exists(previous):
+			os.remove(previous)
+
+writer = None
+
+def get_writer():
+	global writer
+	if writer is None:
+		writer = LogWriter()
+	return writer
+
+class GameLog(object):
+	def __init__(self, directory, game_id, segment=0, snapshot_every=500):
+		self.directory, self.game_id = directory, game_id
+		self.segment = segment
+		self.snapshot_every = snapshot_every
+		self.since_snapshot = 0
+		self.writer = get_writer()
+
+	def path(self, segment):
+		return os.path.join(self.directory, '%s.%d.log' % (self.game_id, segment))
+
+	def record(self, game, event):
+		# Actions are recorded before they change anything, so this is between actions, when the game is consistent.
+		if self.since_snapshot >= self.snapshot_every:
+			self.snapshot(game)
+		self.since_snapshot += 1
+
+		self.writer.write(self, json.dumps(event) + '\n')
+
+	def snapshot(self, game):
+		self.segment += 1
+		self.since_snapshot = 0
+		self.writer.new_segment(
+			self, self.path(self.segment), json.dumps(['snapshot', game.snapshot()]) + '\n', self.path(self.segment-1),
+		)
+
+def attach(game, directory, game_id, segment=0):
+	"""Start logging game, beginning a new segment with a snapshot of it as it is now."""
+	game.event_log = GameLog(directory, game_id, segment)
+	game.event_log.snapshot(game)
+
+def segments(directory):
+	"""game id -> [(segment number, path)], newest first, for every game logged in directory."""
+	found = {}
+	for name in os.listdir(directory):
+		if not name.endswith('.log'):
+			continue
+
+		game_id, segment = name[:-len('.log')].rsplit('.', 1)
+		found.setdefault(game_id, []).append((int(segment), os.path.join(directory, name)))
+
+	for game_segments in found.values():
+		game_segments.sort(reverse=True)
+
+	return found
+
+def read_segment(path):
+	"""The events in a segment, or None if it doesn't start with a whole snapshot."""
+	events = []
+	with open(path) as f:
+		for line in f:
+			# The last line can be cut short by a crash, and nothing after it was written.
+			if not line.endswith('\n'):
+				break
+			try:
+				events.append(json.loads(line))
+			except ValueError:
+				break
+
+	if not events or events[0][0] != 'snapshot':
+		return None
+	return events
+
+def recover(directory, game_class, io_loop=None):
+	"""Rebuild every game logged in directory and carry on logging them. Returns game id -> game.
+
+	A game is recovered from its newest segment that starts with a snapshot. A crash while a new segment was being
+	started can leave that segment without one, but the previous segment is only deleted once the new one is safely
+	on disk, so it is still there to fall back to.
+	"""
+	games = {}
+
+	for game_id, game_segments in segments(directory).items():
+		for segment, path in game_segments:
+			events = read_segment(path)
+			if events is not None:
+				break
+			log.warning("No snapshot to recover %s from, trying an older segment", path)
+		else:
+			log.warning("Couldn't recover %s, no segment has a snapshot", game_id)
+			continue
+
+		game = game_class.from_snapshot(events[0][1], io_loop)
+		game.replay(events[1:])
+
+		# The rest are older, or newer without a usable snapshot. The one recovered from goes once attach has
+		# safely written the next.
+		for other, other_path in game_segments:
+			if other != segment:
+				os.remove(other_path)
+
+		attach(game, directory, game_id, segment)
+		game.drop_disconnected()
+		games[game_id] = game
+
+	return games
@@ -7,6 +7,54 @@ if (typeof String.prototype.startsWith != 'function') {
 $(document).ready(function() {
 	var socket;
 
+	// card_id -> move_type -> targets, kept up to date by valid_moves and valid_moves_delta messages.
+	var valid_moves = {};
+
+	// type id -> name, image and the other details every card of a type shares, see Card.catalogue in cards.py.
+	var card_types = {};
+	var card_types_version = null;
+	// Messages that arrived before the catalogue did, or null once it has loaded.
+	var pending = null;
+
+	// The card art sprite atlas map, see atlas.py, and the image of the tier in use. Null if there isn't one.
+	var atlas = null;
+	var atlas_url = null;
+	var atlas_image = null;
+
+	// The smallest tier that is sharp on this screen, or the biggest there is.
+	function pick_tier(map) {
+		var ratio = window.devicePixelRatio || 1;
+		var tiers = map.tiers.slice().sort(function(a, b) { return a.scale - b.scale; });
+
+		for( var i in tiers ) {
+			if( tiers[i].scale >= ratio ) {
+				return tiers[i];
+			}
+		}
+
+		return tiers[tiers.length - 1];
+	}
+
+	// Percentage background-position of cell index in a row or column of count cells.
+	function cell_position(index, count) {
+		return count > 1 ? (index / (count - 1) * 100) + '%' : '0%';
+	}
+
+	function set_card_art(card_elem, type) {
+		var cell = atlas && atlas.cells[type.image];
+
+		if( !cell ) {
+			card_elem.css('background-image', 'url('+type.image+')');
+			return;
+		}
+
+		card_elem.css({
+			'background-image': 'url('+atlas_image+')',
+			'background-size': (atlas.columns * 100)+'% '+(atlas.rows * 100)+'%',
+			'background-position': cell_position(cell[0], atlas.columns)+' '+cell_position(cell[1], atlas.rows)
+		});
+	}
+
 	var timer_update_speed = 50;
 
 	setInterval(function() {
@@ -108,11 +156,33 @@ $(document).ready(function() {
 		}
 	}
 
+	function show_action(card_id, move_type, targets) {
+		var action_button = $('.card[card_id='+card_id+'] .action_'+move_type);
+		action_button.attr('targets', targets);
+		action_button.show();
+	}
+
+	function hide_action(card_id, move_type) {
+		$('.card[card_id='+card_id+'] .action_'+move_type).hide();
+	}
+
+	function show_card_actions(card_elem, card_id) {
+		card_elem.find('.action').hide();
+
+		var moves = valid_moves[card_id];
+		for( var move_type in moves ) {
+			var action_button = card_elem.find('.action_'+move_type);
+			action_button.attr('targets', moves[move_type]);
+			action_button.show();
+		}
+	}
+
 	function create_card(card) {
 		var new_card = $('.card.template').clone();
 		new_card.removeClass("template");
-		new_card.css('background-image', 'url('+card.image+')');
+		set_card_art(new_card, card_types[card.type]);
 		new_card.attr('card_id', card.id);
+		show_card_actions(new_card, card.id);
 
 		new_card.find('.action_CARRY').click(function() {
 			socket.send(JSON.stringify({
@@ -164,39 +234,131 @@ $(document).ready(function() {
 			socket.close();
 		}
 
-		socket = new WebSocket("ws://localhost:800/socket/"+$("#username").val()+"/"+$("#game_name").val());
+		socket = new WebSocket("ws://localhost:800/socket/"+$("#username").val()+"/"+$("#game_name").val(), WIRE_SUBPROTOCOLS);
+		socket.binaryType = 'arraybuffer';
 
 		socket.onopen = function(){
 		};
 
-		socket.onmessage = function(msg) {
-			var msg = JSON.parse(msg.data);
+		pending = [];
 
+		socket.onmessage = function(event) {
+			var msg = wire.decode(event.data);
+
+			// The server sends everything from one action together in a batch.
+			if (msg.type == "batch") {
+				for( var i in msg.messages ) {
+					receive(msg.messages[i]);
+				}
+			} else {
+				receive(msg);
+			}
+		};
+
+		function receive(msg) {
+			// Most messages show cards, so they wait until the card types they refer to are known.
+			if (msg.type == "catalogue") {
+				load_catalogue(msg);
+			} else if (pending) {
+				pending.push(msg);
+			} else {
+				handle_message(msg);
+			}
+		}
+
+		function load_catalogue(catalogue) {
+			function handle_pending() {
+				var waiting = pending;
+				pending = null;
+
+				for( var i in waiting ) {
+					handle_message(waiting[i]);
+				}
+			}
+
+			var loading = [];
+
+			// The catalogue and atlas urls change with their contents, so the browser can cache them across visits.
+			if( catalogue.version != card_types_version ) {
+				loading.push($.getJSON(catalogue.url, function(types) {
+					card_types = types;
+					card_types_version = catalogue.version;
+				}));
+			}
+
+			if( catalogue.atlas != atlas_url ) {
+				atlas = null;
+				atlas_url = catalogue.atlas;
+
+				if( atlas_url ) {
+					loading.push($.getJSON(atlas_url, function(map) {
+						atlas = map;
+						atlas_image = pick_tier(map).image;
+					}));
+				}
+			}
+
+			// Without the atlas cards fall back to their own images, so don't wait on it failing.
+			$.when.apply($, loading).always(handle_pending);
+		}
+
+		function handle_message(msg) {
 			if (msg.type == "players") {
 				set_players(msg.players);
 			} else if (msg.type == "player") {
 				add_player(msg.player);
-			} else if (msg.type == "draw") {
-				deal_card(msg.player, msg.card);
+			} else if (msg.type == "deal") {
+				for( var i in msg.hands ) {
+					var hand = msg.hands[i];
+
+					for( var j in hand.cards ) {
+						deal_card(hand.player, hand.cards[j]);
+					}
+				}
 			} else if (msg.type == "timeout") {
 				$('.timer_bar').attr('total', msg.timeout);
 				$('.timer_bar').attr('remaining', msg.timeout);
 			} else if (msg.type == "valid_moves") {
+				valid_moves = msg.moves;
+
 				$('.action').hide();
-				for(var card_id in msg.moves) {
-					var moves = msg.moves[card_id];
+				for(var card_id in valid_moves) {
+					var moves = valid_moves[card_id];
 
 					for( var move_type in moves ) {
-						var targets = moves[move_type];
-						var action_button = $('.card[card_id='+card_id+'] .action_'+move_type);
-						action_button.attr('targets', targets);
-						action_button.show();
+						show_action(card_id, move_type, moves[move_type]);
+					}
+				}
+			} else if (msg.type == "valid_moves_delta") {
+				for(var card_id in msg.remove) {
+					var move_types = msg.remove[card_id];
+
+					for( var i in move_types ) {
+						if( valid_moves[card_id] ) {
+							delete valid_moves[card_id][move_types[i]];
+						}
+						hide_action(card_id, move_types[i]);
+					}
+				}
+
+				for(var card_id in msg.add) {
+					var moves = msg.add[card_id];
+					valid_moves[card_id] = valid_moves[card_id] || {};
+
+					for( var move_type in moves ) {
+						valid_moves[card_id][move_type] = moves[move_type];
+						show_action(card_id, move_type, moves[move_type]);
 					}
 				}
 			} else if (msg.type == "message") {
 				if( msg.message.from == "system" ) {
 					$('#console').append($('<div class="console_message system_message">'+msg.message.text+'</div>'));
 				}
+			} else if (msg.type == "error") {
+				$('#console').append($('<div class="console_message system_message">'+msg.message+'</div>'));
+			} else if (msg.type == "combat_status") {
+				$('.combat_odds').text(msg.players_total+' vs '+msg.monsters_total+', '+
+					Math.round(msg.odds * 100)+'% chance the players win');
 			} else if (msg.type == "combat") {
 				var combat = msg.combat;
 				var players = combat.players;
@@ -217,7 +379,7 @@ $(document).ready(function() {
 					$('<span class="combat_player_detail">'+player.find('.player_name').text()+' ('+player.find('.player_total').text()+')</span>').appendTo($('.combat_players'));
 				}
 			}
-		};
+		}
 
 	});
 });
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""Measure the memory held by idle games.
+
+Creates N games with no players and reports how much memory they hold, as counted by tracemalloc.
+
+Run with `python memory_bench.py --games=1000`.
+"""
+import gc
+import tracemalloc
+
+import tornado.options
+
+import server
+
+tornado.options.define('games', default=1000, help="Number of idle games to create")
+
+def measure(count):
+	gc.collect()
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+
+	games = [server.Game() for i in range(count)]
+
+	gc.collect()
+	used = tracemalloc.get_traced_memory()[0] - before
+	tracemalloc.stop()
+
+	return used, len(games[0].cards_by_key)
+
+if __name__ == '__main__':
+	tornado.options.parse_command_line()
+	count = tornado.options.options.games
+
+	used, cards = measure(count)
+	print("%d games, %d cards each" % (count, cards))
+	print("%.1f KiB per game, %.0f bytes per card" % (used / count / 1024.0, used / (count * cards)))
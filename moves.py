@@ -0,0 +1,31 @@
+import cards
+from player import Player
+
+class Move(object):
+	def __init__(self, game, move_type, player, card, target):
+		self.move_type, self.player, self.card, self.target = move_type, player, card, target
+
+		if not isinstance(card, cards.Card):
+			self.card = game.card_from_id(card)
+
+		if not isinstance(player, Player):
+			self.player = game.player_from_id(player)
+
+		if isinstance(target, dict):
+			if target['type'] == 'card':
+				self.target = game.card_from_id(target['id'])
+			elif target['type'] == 'player':
+				self.target = game.player_from_id(target['id'])
+			elif target['type'] == 'combat':
+				# target id should be either 'players' or 'monsters'.
+				self.target = 'combat_'+target['id']
+			else:
+				raise Exception('TODO')
+
+	def touched_players(self):
+		"""Players whose cards this move can change."""
+		touched = {self.player}
+		if isinstance(self.target, Player):
+			touched.add(self.target)
+
+		return touched
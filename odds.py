@@ -0,0 +1,144 @@
+"""Estimate how likely the players are to win the current combat.
+
+Every combat card someone might still play is a slot. Cards the viewer can see have a known bonus and side, face
+down cards are drawn from what the viewer hasn't seen of their deck. Each rollout plays every slot with some
+chance and checks which side ends up ahead. With numpy every rollout is drawn in one batch, without it the same
+model runs as a python loop.
+"""
+import random
+from enums import Moves, Phases, Targets
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+def is_combat_card(card):
+	return Targets.COMBAT in card.candidate_targets(Phases.COMBAT, Moves.PLAY)
+
+def combat_bonus(card):
+	return card.bonus if is_combat_card(card) else 0
+
+def slots(game, viewer=None, leave_out=None):
+	"""The viewer's picture of the cards still to play: (known bonuses, unknown slots per deck, unseen bonuses per deck).
+
+	Bonuses are signed, positive helps the players. Unknown slots are (deck, sign) pairs. leave_out is a card of the
+	viewer's to leave out of the known bonuses.
+	"""
+	combat = game.combat
+	known = []
+	unknown = []
+	unseen = {}
+
+	for deck in (game.door_deck, game.treasure_deck):
+		unseen[deck] = [combat_bonus(card) for card in deck.cards]
+
+	for player in game.players:
+		# Players help their own fight and hinder everyone else's.
+		sign = 1 if player in combat.players else -1
+
+		for card in player.carried:
+			if is_combat_card(card):
+				known.append(sign * card.bonus)
+
+		for card in player.hand:
+			if player == viewer:
+				if is_combat_card(card) and card is not leave_out:
+					known.append(sign * card.bonus)
+			else:
+				unknown.append((card.deck, sign))
+				unseen[card.deck].append(combat_bonus(card))
+
+	return known, unknown, unseen
+
+def seeded_rng(*key):
+	"""A generator for win_probability that draws the same numbers every time it's made from the same ints."""
+	if numpy is not None:
+		return numpy.random.default_rng(list(key))
+	return random.Random(':'.join(str(part) for part in key))
+
+def win_probability(game, viewer=None, rollouts=4096, play_chance=0.5, rng=None):
+	"""Chance the players win game.combat if everyone plays each combat card they hold with play_chance.
+
+	viewer is the player whose knowledge to use, None for only what everyone can see.
+	"""
+	return _wins(_totals(game, viewer, rollouts, play_chance, _generator(rng)))
+
+def play_odds(game, viewer, card, target, rollouts=512, play_chance=0.5, rng=None):
+	"""(before, after): the chance the players win game.combat with card still in the viewer's hand, and once the
+	viewer has played it on target, 'combat_players' or 'combat_monsters'.
+
+	Both come from the same rollouts, so the difference between them is down to the card rather than to chance.
+	"""
+	rng = _generator(rng)
+	totals = _totals(game, viewer, rollouts, play_chance, rng, leave_out=card)
+	bonus = card.bonus if target == 'combat_players' else -card.bonus
+
+	if numpy is not None:
+		held = totals + bonus * (rng.random(len(totals)) < play_chance)
+		return _wins(held), _wins(totals + bonus)
+
+	held = [total + bonus if rng.random() < play_chance else total for total in totals]
+	return _wins(held), _wins([total + bonus for total in totals])
+
+def _generator(rng):
+	if rng is not None:
+		return rng
+	return numpy.random.default_rng() if numpy is not None else random
+
+def _wins(totals):
+	"""The fraction of rollouts the players win."""
+	if numpy is not None:
+		return float(numpy.count_nonzero(totals > 0)) / len(totals)
+	return float(sum(1 for total in totals if total > 0)) / len(totals)
+
+def _totals(game, viewer, rollouts, play_chance, rng, leave_out=None):
+	"""Players' total less the monsters' at the end of each rollout, as a numpy array when numpy is installed."""
+	margin = game.combat.margin()
+	known, unknown, unseen = slots(game, viewer, leave_out)
+
+	# Cards that can't change the totals can't change the outcome.
+	known = [bonus for bonus in known if bonus]
+	unknown = [(deck, sign) for deck, sign in unknown if any(unseen[deck])]
+
+	if numpy is not None:
+		return _numpy_totals(margin, known, unknown, unseen, rollouts, play_chance, rng)
+	return _python_totals(margin, known, unknown, unseen, rollouts, play_chance, rng)
+
+def _numpy_totals(margin, known, unknown, unseen, rollouts, play_chance, rng):
+	# Bonuses are small integers, so float64 sums are exact and go through BLAS.
+	totals = numpy.full(rollouts, float(margin))
+
+	if known:
+		played = rng.random((rollouts, len(known))) < play_chance
+		totals += played @ numpy.array(known, dtype=numpy.float64)
+
+	for deck, pool in unseen.items():
+		signs = numpy.array([sign for slot_deck, sign in unknown if slot_deck is deck], dtype=numpy.float64)
+		if not len(signs):
+			continue
+
+		pool = numpy.array(pool, dtype=numpy.float64)
+		bonuses = pool[rng.integers(0, len(pool), size=(rollouts, len(signs)))]
+		played = rng.random((rollouts, len(signs))) < play_chance
+		totals += (bonuses * played) @ signs
+
+	return totals
+
+def _python_totals(margin, known, unknown, unseen, rollouts, play_chance, rng):
+	totals = []
+
+	for i in range(rollouts):
+		total = margin
+
+		for bonus in known:
+			if rng.random() < play_chance:
+				total += bonus
+
+		for deck, sign in unknown:
+			if unseen[deck] and rng.random() < play_chance:
+				total += sign * rng.choice(unseen[deck])
+
+		totals.append(total)
+
+	return totals
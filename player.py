@@ -1,6 +1,4 @@
-import logging
-
-log = logging.getLogger("MunchkinServer")
+from zones import Zone
 
 class Player(object):
 
@@ -8,26 +6,26 @@ class Player(object):
 		self.level = 1
 		self.bonus = 0
 		self.id = 0
-		self.hand = []
-		self.carried = []
+		self.hand = Zone('hand', self)
+		self.carried = Zone('carried', self)
 		self.name = name
 		self.connected = True
 		self.connection = connection
 		self.ready = False
 		self.race = None
+		# The combat the player is in, which keeps a running total of their strength.
+		self.combat = None
 
 	def info(self, other_player=None):
 		show_hand = other_player == None or other_player == self
 
-		log.debug([(card.name, card.id) for card in self.hand])
-		log.debug([(card.name, card.id) for card in self.carried])
 		return {
 			'name': self.name, 
 			'id': self.id,
 			'level': self.level,
 			'bonus': self.bonus,
 			'total': self.total,
-			'hand': [card.info() if show_hand else card.deck.hidden_card(card.id).info() for card in self.hand],
+			'hand': [card.info() if show_hand else card.deck.hidden_info(card.id) for card in self.hand],
 			'carried': [card.info() for card in self.carried],
 		}
 
@@ -35,17 +33,24 @@ class Player(object):
 	def total(self):
 		return self.level + self.bonus
 
+	def changed(self):
+		if self.combat:
+			self.combat.update_player(self)
+
 	def level_up(self, count=1, monster_kill=False):
 		if monster_kill:
 			self.level += count
 		else:
 			self.level = min(9, self.level+count)
+		self.changed()
 
 	def level_down(self):
 		self.level = max(1, self.level-1)
+		self.changed()
 
 	def equip(self, card):
 		self.bonus += card.bonus_on_player(self)
+		self.changed()
 
 	@property
 	def all_cards(self):
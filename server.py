@@ -1,16 +1,23 @@
+import os
+import hmac
 import random
 import cards
+import odds
 import logging
-import threading
 import json
-import time
-from enums import Moves, Phases
-from collections import defaultdict
+import hashlib
+import wire
+import gamelog
+import tornado.ioloop
+from enums import Moves, Phases, Targets
+from collections import defaultdict, deque
 from ai import AI
 from player import Player
+from moves import Move
+from zones import Zone
 
+# Takes its level from tornado's --logging option, run with --logging=debug to see every message sent.
 log = logging.getLogger("MunchkinServer")
-log.setLevel(logging.DEBUG)
 
 #placeholder for gettext
 def gettext(string):
@@ -43,44 +50,61 @@ class CachedAttribute(object):
 class Deck(object):
 	
 	def __init__(self, game, id_generator):
-		self.cards = []
-		self.discards = []
+		self.cards = Zone('deck', self)
+		self.discards = Zone('discards', self)
 		self.id_generator = id_generator
 		self.game = game
+		self.shuffles = 0
+		# Face down stand-ins and their info, built once per id and shared by every viewer.
+		self.hidden_cards = {}
+		self.hidden_infos = {}
 
 	def add_to_deck(self, card_class, count=1):
 		for i in range(count):
 			new_card = card_class(self.game, self, self.id_generator.new_id())
 			self.cards.append(new_card)
-			self.game.cards[new_card.id] = new_card
+			self.game.cards_by_key[new_card.key] = new_card
 
 	def draw(self):
+		"""Draw the top card, or None if every card is already out of the deck and discards."""
 		if not self.cards:
 			self.reset()
 
-		return self.cards.pop()
+		if not self.cards:
+			return None
+
+		card = self.cards.pop()
+		# The card keeps the id it has now until it is shuffled back in.
+		card.epoch = self.shuffles
+		return card
 		
 	def reset(self):
-		self.cards = self.cards + self.discards
-		self.discards = []
+		for card in self.discards:
+			card.epoch = None
+
+		self.cards.extend(self.discards)
 		self.shuffle()
 
 	def shuffle(self, discards=False):
-		if discards:
-			random.shuffle(self.discards)
-		else:
-			random.shuffle(self.cards)
-
-		# Regenerate the id's after the cards have been shuffled so that you can't track the ids.
-		for card in self.cards:
-			# remove old card id and re-add to game. This solution kind of sucks TODO make nice
-			del self.game.cards[card.id]
-			card.id = self.id_generator.new_id()
-			self.game.cards[card.id] = card
+		(self.discards if discards else self.cards).shuffle(self.game.rng)
+
+		# Every card in the deck gets a new id, so you can't track cards through a shuffle. See Game.public_id.
+		self.shuffles += 1
+
+	def hidden_card(self, id):
+		if id not in self.hidden_cards:
+			self.hidden_cards[id] = cards.HiddenCard(id, self.hidden_class)
+
+		return self.hidden_cards[id]
+
+	def hidden_info(self, id):
+		if id not in self.hidden_infos:
+			self.hidden_infos[id] = self.hidden_card(id).info()
+
+		return self.hidden_infos[id]
 	
 class ClassicDoorDeck(Deck):
-	def hidden_card(self, id):
-		return cards.DoorCard(self.game, self, id)
+	hidden_class = cards.DoorCard
 
 	name = "Door"
 
@@ -91,8 +115,8 @@ class ClassicDoorDeck(Deck):
 		self.shuffle()
 
 class ClassicTreasureDeck(Deck):
-	def hidden_card(self, id):
-		return cards.TreasureCard(self.game, self, id)
+	hidden_class = cards.TreasureCard
+
 	name = "Treasure"
 
 	def __init__(self, game, id_generator):
@@ -109,43 +133,117 @@ class IdHolder(object):
 		self.current_id += 1
 		return self.current_id
 
-class Move(object):
-	def __init__(self, game, move_type, player, card, target):
-		self.move_type, self.player, self.card, self.target = move_type, player, card, target
+class Combat(object):
 
-		if not isinstance(card, cards.Card):
-			self.card = game.card_from_id(card)
+	def __init__(self, players, monster_cards, on_change=None):
+		self.players = []
+		self.monster_cards = Zone('combat_monsters', self)
+		self.player_modifier_cards = Zone('combat_player_modifiers', self)
+		self.monster_modifier_cards = Zone('combat_monster_modifiers', self)
 
-		if not isinstance(player, Player):
-			self.player = game.player_from_id(player)
+		# Running totals, kept up to date by the methods below so outcome queries are O(1).
+		# Each side's total includes the modifier cards played on it.
+		self.player_strengths = {}
+		self.monster_strengths = {}
+		self._players_total = 0
+		self._monsters_total = 0
+		self.on_change = None
 
-		if isinstance(target, dict):
-			if target['type'] == 'card':
-				self.target = game.card_from_id(target['id'])
-			elif target['type'] == 'player':
-				self.target = game.player_from_id(target['id'])
-			elif target['type'] == 'combat':
-				# target id should be either 'players' or 'monsters'.
-				self.target = 'combat_'+target['id']
-			else:
-				raise Exception('TODO')
+		for player in players:
+			self.add_player(player)
 
+		for monster in monster_cards:
+			self.add_monster(monster)
 
-class Combat(object):
+		# Set after the initial adds, so it only hears about changes.
+		self.on_change = on_change
 
-	def __init__(self, players, monster_cards):
-		self.players, self.monster_cards = players, monster_cards
-		self.player_modifier_cards = []
-		self.monster_modifier_cards = []
+	def changed(self):
+		if self.on_change:
+			self.on_change()
+
+	def add_player(self, player):
+		self.players.append(player)
+		player.combat = self
+		self.update_player(player)
+
+	def remove_player(self, player):
+		self.players.remove(player)
+		player.combat = None
+		self._players_total -= self.player_strengths.pop(player)
+		self.update_monsters()
+
+	def update_player(self, player):
+		"""Recount a player after their level, bonus or race changed."""
+		strength = player.level + player.bonus
+		self._players_total += strength - self.player_strengths.get(player, 0)
+		self.player_strengths[player] = strength
+
+		# Monster bonuses depend on who they're fighting.
+		self.update_monsters()
+
+	def add_monster(self, monster):
+		self.monster_cards.append(monster)
+		self.update_monster(monster)
+		self.changed()
+
+	def remove_monster(self, monster):
+		self.monster_cards.remove(monster)
+		self._monsters_total -= self.monster_strengths.pop(monster)
+		self.changed()
+
+	def update_monster(self, monster):
+		strength = monster.level + max([monster.bonus(player) for player in self.players] or [0])
+		self._monsters_total += strength - self.monster_strengths.get(monster, 0)
+		self.monster_strengths[monster] = strength
+
+	def update_monsters(self):
+		for monster in self.monster_cards:
+			self.update_monster(monster)
+
+		self.changed()
+
+	def add_modifier(self, card, side):
+		"""Play card on side, either 'combat_players' or 'combat_monsters'."""
+		if side == 'combat_players':
+			self.player_modifier_cards.append(card)
+			self._players_total += card.bonus
+		elif side == 'combat_monsters':
+			self.monster_modifier_cards.append(card)
+			self._monsters_total += card.bonus
+		else:
+			raise Exception('Invalid target')
+
+		self.changed()
+
+	def remove_modifier(self, card):
+		if card in self.player_modifier_cards:
+			self.player_modifier_cards.remove(card)
+			self._players_total -= card.bonus
+		elif card in self.monster_modifier_cards:
+			self.monster_modifier_cards.remove(card)
+			self._monsters_total -= card.bonus
+
+		self.changed()
+
+	def finish(self):
+		"""Stop tracking changes, the outcome is being decided."""
+		self.on_change = None
+		for player in self.players:
+			player.combat = None
 
 	def players_win(self):
 		return self.players_total() > self.monsters_total()
 
 	def players_total(self):
-		return sum(player.level+player.bonus for player in self.players)
+		return self._players_total
 
 	def monsters_total(self):
-		return sum(monster.level+max(monster.bonus(player) for player in self.players) for monster in self.monster_cards)
+		return self._monsters_total
+
+	def margin(self):
+		"""How far the players are ahead of the monsters."""
+		return self._players_total - self._monsters_total
 
 	def treasures(self):
 		return sum(monster.treasures for monster in self.monster_cards)
@@ -161,13 +259,44 @@ class Combat(object):
 
 class EventSystem(object):
 	id = 0
+	actions_scheduled = False
+
+	# Use a cached attribute so subclasses can set their own loop without calling __init__
+	@CachedAttribute
+	def io_loop(self):
+		return tornado.ioloop.IOLoop.current()
+
+	@CachedAttribute
+	def actions(self):
+		return deque()
+
+	def submit(self, func, *args):
+		"""Queue func(*args) to run on the IOLoop after every action already queued.
+
+		Everything that changes the game goes through here, so it is only ever touched by one action at a time.
+		"""
+		self.actions.append((func, args))
+
+		if not self.actions_scheduled:
+			self.actions_scheduled = True
+			self.io_loop.add_callback(self.run_actions)
+
+	def run_actions(self):
+		self.actions_scheduled = False
+
+		while self.actions:
+			func, args = self.actions.popleft()
+			try:
+				func(*args)
+			except Exception:
+				log.exception("Error running "+func.__name__)
 
 	def sched(self, func, delay):
-		class SchedThread(threading.Thread):
-			def run(self):
-				time.sleep(delay)
-				func()
-		SchedThread().start()
+		"""Submit func after delay seconds. Returns a handle that can be passed to unsched."""
+		return self.io_loop.call_later(delay, self.submit, func)
+
+	def unsched(self, handle):
+		self.io_loop.remove_timeout(handle)
 
 	# Use a cached attributes so we don't need to call __init__
 	@CachedAttribute
@@ -209,69 +338,135 @@ class EventSystem(object):
 		self.one_time_handlers[key] = []
 
 class Game(EventSystem):
-	def __init__(self, password=None):
+	def __init__(self, password=None, io_loop=None, seed=None):
 		id_generator = IdHolder()
 
+		# Everything random in a game, card effects included, draws from its own rng, so the seed and the actions
+		# taken are enough to play it out again.
+		self.seed = int.from_bytes(os.urandom(8), 'big') if seed is None else seed
+		self.rng = random.Random(self.seed)
+		log.debug("Game seed %d", self.seed)
+
+		self.io_loop = io_loop or tornado.ioloop.IOLoop.current()
+
 		self.players = []
+		# Public id -> card, see public_id. Entries come and go as ids change, cards_by_key never changes.
 		self.cards = {}
+		self.cards_by_key = {}
+		# From the seeded rng, so a seed replays to the same public ids. The seed has to stay as private as the secret.
+		self.secret = self.rng.getrandbits(128).to_bytes(16, 'big')
 		self.password = password
 		self.started = False
 		self.killed = False
 		self.action_number = 1
 		self.phase = None
 		self.current_player = None
+		self.timeout_timer = None
+		# The valid moves each player was last sent, so later updates can be sent as deltas.
+		self.sent_moves = {}
+		# Players whose valid moves target other cards, and so can change when anyone's cards do.
+		self.card_targeting = set()
+		self.combat = None
+		# The gamelog.GameLog recording this game, if any.
+		self.event_log = None
 
 		self.door_deck = ClassicDoorDeck(self, id_generator)
 		self.treasure_deck = ClassicTreasureDeck(self, id_generator)
 
 	def discard(self, card):
-		for player in self.players:
-			if card in player.hand:
-				player.hand.remove(card)
-			if card in player.carried:
-				player.carried.remove(card)
-
 		card.deck.discards.append(card)
 
+	def record(self, *event):
+		if self.event_log:
+			self.event_log.record(self, list(event))
+
+	def public_id(self, card):
+		"""The id clients know card by.
+
+		It is derived from the card's key and the deck shuffle count it was last drawn at, keyed with a per-game
+		secret, so shuffling only has to bump the deck's count for every card in it to get a new, unlinkable id.
+		"""
+		epoch = card.deck.shuffles if card.epoch is None else card.epoch
+
+		if card._id_epoch != epoch:
+			if card._id is not None:
+				self.cards.pop(card._id, None)
+				card.deck.hidden_cards.pop(card._id, None)
+				card.deck.hidden_infos.pop(card._id, None)
+
+			digest = hmac.new(self.secret, ('%d:%d' % (card.key, epoch)).encode('ascii'), hashlib.sha256).digest()
+			# 48 bits, so javascript can hold it exactly.
+			card._id = int.from_bytes(digest[:6], 'big')
+			card._id_epoch = epoch
+			self.cards[card._id] = card
+
+		return card._id
+
 	def card_from_id(self, id):
-		return self.cards[int(id)]
+		card = self.cards[int(id)]
+
+		# Ids from before a shuffle are only dropped from the index lazily.
+		if card.id != int(id):
+			raise KeyError(id)
+
+		return card
 
 	def player_from_id(self, id):
 		return self.players[int(id)]
 
 	def update_player(self, player):
-		for other_player in self.players:
-			self.send(other_player, {
-				'type': 'player',
-				'player': player.info(other_player)
-			})
+		# Everyone but the player themselves sees the same hidden hand.
+		self.send_each(lambda other_player: {
+			'type': 'player',
+			'player': player.info(other_player)
+		}, lambda other_player: other_player == player)
 
 	def update_players(self):
 		for p_id, player in enumerate(self.players):
 			player.id = p_id
 
+		# Each player's info is encoded once face up and once face down per format, then spliced into every message.
+		infos = {}
+		def info(player, other_player):
+			key = (player, player == other_player)
+			if key not in infos:
+				infos[key] = wire.Message(player.info(other_player))
+			return infos[key]
+
+		template = self.encode_around({'type': "players"}, 'players')
 		for other_player in self.players:
-			self.send(other_player, {
-				'type': "players",
-				'players': [player.info(other_player) for player in self.players],
-			})
+			self.send_raw(other_player, template.fill([info(player, other_player) for player in self.players]))
 
+		# Clients redraw every card on a players message, so resend the full set of moves.
+		self.sent_moves = {}
 		if self.phase:
 			self.update_valid_moves()
 
 	def add_player(self, player):
+		self.record('join', player.name, isinstance(player, AI))
 		self.players.append(player)
 
 		self.update_players()
 
 		if len(self.players) == 2:
 			self.broadcast_message("Starting game!")
-			game = self
-			class GameThread(threading.Thread):
-				def run(self):
-					game.start()
+			self.submit(self.start)
+
+	def remove_player(self, player):
+		self.record('leave', self.players.index(player))
+		self.players.remove(player)
 
-			GameThread().start()
+	def drop_disconnected(self):
+		"""Remove humans who aren't connected from a game that hasn't started, as if they had left.
+
+		Leaving a lobby is the same as disconnecting from it, see GameClient.leave, so a recovered lobby can't keep
+		seats for players that come back: they join again.
+		"""
+		if self.started:
+			return
+
+		for player in [player for player in self.players if not player.connected]:
+			self.remove_player(player)
 
 	def change_phase(self, player, phase):
 		if player and player != self.current_player:
@@ -284,16 +479,36 @@ class Game(EventSystem):
 		self.update_valid_moves()
 		self.timeout(15.0)
 
-	def update_valid_moves(self):
+	def update_valid_moves(self, players=None):
+		"""Send each player the changes to their valid moves.
+
+		If players is given only they are recomputed, along with anyone whose moves can target other cards.
+		Players that haven't been sent their moves yet get the full set.
+		"""
+		if players is not None:
+			players = set(players) | self.card_targeting
+
 		for player in self.players:
+			if players is not None and player not in players:
+				continue
+
 			player_moves = self.get_valid_moves(player)
-			self.send(player, {'type': 'valid_moves', 'moves':player_moves})
+
+			if player not in self.sent_moves:
+				self.send(player, {'type': 'valid_moves', 'moves':player_moves})
+			else:
+				add, remove = moves_delta(self.sent_moves[player], player_moves)
+				if add or remove:
+					self.send(player, {'type': 'valid_moves_delta', 'add': add, 'remove': remove})
+
+			self.sent_moves[player] = player_moves
 
 			# If the player has no moves, auto-ready them. If their only move has no card, their only move is to ready. Ready them.
 			# if (not player.ready) and ((not player_moves) or (len(player_moves) == 1 and None in player_moves)):
 			# 	self.ready(player)
 
 	def ready(self, player):
+		self.record('ready', self.players.index(player))
 		self.broadcast_message(player.name + " is ready")
 		player.ready = True
 		all_ready = True
@@ -309,23 +524,26 @@ class Game(EventSystem):
 
 	def next_phase(self):
 		if self.phase == Phases.SETUP:
-			self.change_phase(random.choice(self.players), Phases.BEGIN)
+			self.change_phase(self.rng.choice(self.players), Phases.BEGIN)
 
 		elif self.phase == Phases.BEGIN:
 			# Kick down the door!
 			door_card = self.door_deck.draw()
 
 			if isinstance(door_card, cards.Monster):
-				self.combat = Combat([self.current_player], [door_card])
+				self.combat = Combat([self.current_player], [door_card], on_change=self.broadcast_combat_status)
 
 				self.broadcast({
 					'type': 'combat',
 					'combat': self.combat.info(),
 				})
+				self.broadcast_combat_status()
 
 				self.change_phase(self.current_player, Phases.COMBAT)
 
 		elif self.phase == Phases.COMBAT:
+			self.combat.finish()
+
 			if self.combat.players_win():
 				self.broadcast_message("Player", self.combat.players[0].name, 
 										"wins:", self.combat.treasures(), 
@@ -342,16 +560,17 @@ class Game(EventSystem):
 
 			else:
 				self.broadcast_message("Player", self.combat.players[0].name, 
-										"loses! Bad stuff:", self.combat.monster_cards[0].bad_stuff.__doc__)
+										"loses! Bad stuff:", next(iter(self.combat.monster_cards)).bad_stuff.__doc__)
 
 				for monster in self.combat.monster_cards:
 					for player in self.combat.players:
 						monster.bad_stuff(player)
 
-			for card in self.combat.monster_cards:
+			# Discarding moves the card out of combat, so iterate over copies.
+			for card in list(self.combat.monster_cards):
 				card.discard()
 
-			for card in self.combat.player_modifier_cards + self.combat.monster_modifier_cards:
+			for card in list(self.combat.player_modifier_cards) + list(self.combat.monster_modifier_cards):
 				if hasattr(card, 'discard'):
 					card.discard()
 
@@ -360,22 +579,23 @@ class Game(EventSystem):
 				
 			self.combat = None
 			
-			self.change_phase(self.current_player, Phases.POST_COMBAT)
+			# Someone reaching level 10 has already ended the game.
+			if self.phase != Phases.END:
+				self.change_phase(self.current_player, Phases.POST_COMBAT)
 		elif self.phase == Phases.POST_COMBAT:
 			self.change_phase(self.players[(self.players.index(self.current_player) + 1) % len(self.players)], Phases.BEGIN)
 
 
 
 	def setup(self):
-		for player in self.players:
-			self.deal(player, self.door_deck, count=4)
-			self.deal(player, self.treasure_deck, count=4)
+		self.deal_many({player: {self.door_deck: 4, self.treasure_deck: 4} for player in self.players})
 
 		self.change_phase(None, Phases.SETUP)
 		self.timeout(10.0)
 
 	def start(self):
 		log.debug("Starting game")
+		self.record('start')
 
 		self.started = True
 		self.setup()
@@ -395,48 +615,72 @@ class Game(EventSystem):
 	def is_potentially_valid(self, move):
 		return move in self.potential_moves(self.phase)
 
+	POTENTIAL_MOVES = {
+		Phases.SETUP : [Moves.DONE, Moves.CARRY],
+		Phases.BEGIN : [Moves.DRAW, Moves.CARRY, Moves.PLAY],
+		Phases.PRE_DRAW : [Moves.DRAW, Moves.PLAY, Moves.CARRY],
+		Phases.KICK_DOOR : [Moves.DRAW, Moves.PLAY, Moves.CARRY],
+		Phases.COMBAT : [Moves.PLAY],
+		Phases.POST_COMBAT : [Moves.PLAY, Moves.CARRY, Moves.DONE],
+		Phases.LOOT_ROOM : [Moves.PLAY, Moves.CARRY, Moves.DONE],
+		Phases.CHARITY : [Moves.PLAY, Moves.CARRY, Moves.DONE, Moves.GIVE],
+		Phases.END : [],
+	}
+
 	def potential_moves(self, phase):
-		return {
-			Phases.SETUP : [Moves.DONE, Moves.CARRY],
-			Phases.BEGIN : [Moves.DRAW, Moves.CARRY, Moves.PLAY],
-			Phases.PRE_DRAW : [Moves.DRAW, Moves.PLAY, Moves.CARRY],
-			Phases.KICK_DOOR : [Moves.DRAW, Moves.PLAY, Moves.CARRY],
-			Phases.COMBAT : [Moves.PLAY],
-			Phases.POST_COMBAT : [Moves.PLAY, Moves.CARRY, Moves.DONE],
-			Phases.LOOT_ROOM : [Moves.PLAY, Moves.CARRY, Moves.DONE],
-			Phases.CHARITY : [Moves.PLAY, Moves.CARRY, Moves.DONE, Moves.GIVE],
-			Phases.END : [],
-		}[phase]
+		return self.POTENTIAL_MOVES[phase]
 
 	def all_cards(self, player):
-		return [card if ((not card.in_hand) or card in player.hand) else card.deck.hidden_card(card.id) for card in self.cards.values()]
+		return [card if ((not card.in_hand) or card in player.hand) else card.deck.hidden_card(card.id) for card in self.cards_by_key.values()]
+
+	def targets(self, player, kind):
+		if kind == Targets.NONE:
+			return [None]
+		elif kind == Targets.CARD:
+			return self.all_cards(player)
+		elif kind == Targets.COMBAT:
+			return ["combat_monsters", "combat_players"] if self.phase == Phases.COMBAT else []
 
 	def get_valid_moves(self, player):
 		potential = self.potential_moves(self.phase)
 		valid = defaultdict(lambda: defaultdict(list))
 		if Moves.DONE in potential:
 			valid[None][Moves.DONE].append(None)
-			potential.remove(Moves.DONE)
 
-		phase_specific_targets = ["combat_monsters", "combat_players"] if self.phase == Phases.COMBAT else []
+		in_turn = self.is_turn(player)
+		player_cards = list(player.all_cards)
+		# Only build each kind of target list once, and only if some card can use it.
+		targets = {}
 
 		for move in potential:
-			for card in player.all_cards:
-				for target in [None] + self.all_cards(player) + phase_specific_targets:
-					if card.can_play(move, target, self.phase, self.is_turn(player)):
-						valid[card.id][move].append(target.info() if hasattr(target, "info") else target)
+			if move == Moves.DONE:
+				continue
+
+			for card in player_cards:
+				for kind in card.candidate_targets(self.phase, move):
+					if kind not in targets:
+						targets[kind] = self.targets(player, kind)
+
+					for target in targets[kind]:
+						if card.can_play(move, target, self.phase, in_turn):
+							valid[card.id][move].append(target.info() if hasattr(target, "info") else target)
+
+		if Targets.CARD in targets:
+			self.card_targeting.add(player)
+		else:
+			self.card_targeting.discard(player)
 
 		return valid
 
 	def play_move(self, move):
 		if not self.is_valid(move):
 			raise Exception('INVALID MOVE')
+		self.record('move', move.move_type, self.players.index(move.player), move.card.key, self.encode_target(move.target))
 		self.action_number += 1
 
 		card, player = move.card, move.player
 
 		if move.move_type == Moves.CARRY:
-			player.hand.remove(card)
 			player.carried.append(card)
 			card.in_hand = False
 
@@ -449,25 +693,162 @@ class Game(EventSystem):
 		if move.move_type == Moves.PLAY:
 			result, value = card.play(move.target)
 			if result == 'attach_to_combat':
-				if value == 'combat_players':
-					self.combat.player_modifier_cards.append(card)
-				elif value == 'combat_monsters':
-					self.combat.monster_modifier_cards.append(card)
-				else:
-					raise Exception('Invalid target')
-
+				self.combat.add_modifier(card, value)
 				card.in_hand = False
 
-				if card in player.hand:
-					player.hand.remove(card)
-
-				if card in player.carried:
-					player.carried.remove(card)
-
 		self.update_player(player)
-		self.update_valid_moves()
+		self.update_valid_moves(move.touched_players())
 		self.timeout(15.0)
 
+	def encode_target(self, target):
+		if isinstance(target, cards.Card):
+			return ['card', target.key]
+		if isinstance(target, Player):
+			return ['player', self.players.index(target)]
+		return target
+
+	def decode_target(self, target):
+		if isinstance(target, list):
+			kind, value = target
+			return self.cards_by_key[value] if kind == 'card' else self.players[value]
+		return target
+
+	def snapshot(self):
+		"""Everything needed to rebuild the game with from_snapshot, as json-able values."""
+		combat = self.combat
+		index = lambda player: None if player is None else self.players.index(player)
+		keys = lambda zone: [card.key for card in zone]
+
+		version, internal, gauss_next = self.rng.getstate()
+
+		return {
+			'seed': self.seed,
+			'rng': [version, list(internal), gauss_next],
+			'secret': self.secret.hex(),
+			'password': self.password,
+			'started': self.started,
+			'action_number': self.action_number,
+			'phase': self.phase,
+			'current_player': index(self.current_player),
+			'players': [{
+				'name': player.name,
+				'ai': isinstance(player, AI),
+				'level': player.level,
+				'bonus': player.bonus,
+				'race': player.race,
+				'ready': player.ready,
+				'hand': keys(player.hand),
+				'carried': keys(player.carried),
+			} for player in self.players],
+			'decks': [{
+				'cards': keys(deck.cards),
+				'discards': keys(deck.discards),
+				'shuffles': deck.shuffles,
+			} for deck in (self.door_deck, self.treasure_deck)],
+			'cards': [[card.key, card.in_hand, card.epoch] for card in self.cards_by_key.values()],
+			'combat': combat and {
+				'players': [index(player) for player in combat.players],
+				'monster_cards': keys(combat.monster_cards),
+				'combat_players': keys(combat.player_modifier_cards),
+				'combat_monsters': keys(combat.monster_modifier_cards),
+			},
+		}
+
+	@classmethod
+	def from_snapshot(cls, state, io_loop=None):
+		game = cls(state['password'], io_loop, state['seed'])
+		version, internal, gauss_next = state['rng']
+		game.rng.setstate((version, tuple(internal), gauss_next))
+		game.secret = bytes.fromhex(state['secret'])
+		game.started = state['started']
+		game.action_number = state['action_number']
+		game.phase = state['phase']
+		by_key = game.cards_by_key
+
+		for key, in_hand, epoch in state['cards']:
+			card = by_key[key]
+			card.in_hand, card.epoch = in_hand, epoch
+			# Cards only go back into the zones the snapshot lists them in.
+			card.zone.remove(card)
+
+		for deck, deck_state in zip((game.door_deck, game.treasure_deck), state['decks']):
+			deck.cards.extend(by_key[key] for key in deck_state['cards'])
+			deck.discards.extend(by_key[key] for key in deck_state['discards'])
+			deck.shuffles = deck_state['shuffles']
+
+		for player_id, player_state in enumerate(state['players']):
+			if player_state['ai']:
+				player = AI(player_state['name'], game)
+			else:
+				# Human players take their seat back when they reconnect to a started game, see GameClient.join.
+				player = Player(player_state['name'], None)
+				player.connected = False
+
+			player.id = player_id
+			player.level, player.bonus, player.race = player_state['level'], player_state['bonus'], player_state['race']
+			player.ready = player_state['ready']
+			player.hand.extend(by_key[key] for key in player_state['hand'])
+			player.carried.extend(by_key[key] for key in player_state['carried'])
+			game.players.append(player)
+
+		if state['current_player'] is not None:
+			game.current_player = game.players[state['current_player']]
+
+		combat_state = state['combat']
+		if combat_state:
+			game.combat = Combat(
+				[game.players[player_id] for player_id in combat_state['players']],
+				[by_key[key] for key in combat_state['monster_cards']],
+			)
+			for side in ('combat_players', 'combat_monsters'):
+				for key in combat_state[side]:
+					game.combat.add_modifier(by_key[key], side)
+			game.combat.on_change = game.broadcast_combat_status
+
+		return game
+
+	def replay(self, events):
+		"""Redo logged actions on a game restored from the snapshot before them.
+
+		The snapshot includes the state of the game's rng, so every action draws what it drew the first time.
+		"""
+		event_log, self.event_log = self.event_log, None
+
+		for event in events:
+			try:
+				self.replay_action(*event)
+			except Exception:
+				log.exception("Error replaying %s", event)
+
+			# Anything the action queued is in the log if it ran.
+			self.actions.clear()
+
+		self.event_log = event_log
+
+		if self.phase:
+			self.timeout(15.0)
+
+	def replay_action(self, kind, *args):
+		if kind == 'join':
+			name, is_ai = args
+			if is_ai:
+				player = AI(name, self)
+			else:
+				player = Player(name, None)
+				player.connected = False
+			self.add_player(player)
+		elif kind == 'leave':
+			self.remove_player(self.players[args[0]])
+		elif kind == 'start':
+			self.start()
+		elif kind == 'ready':
+			self.ready(self.players[args[0]])
+		elif kind == 'move':
+			move_type, player_id, card_key, target = args
+			self.play_move(Move(
+				self, move_type, self.players[player_id], self.cards_by_key[card_key], self.decode_target(target),
+			))
+
 	def timeout(self, timeout):
 		current_action = self.action_number
 
@@ -476,7 +857,11 @@ class Game(EventSystem):
 				for player in self.players:
 					self.ready(player)
 
-		self.sched(ready_players, timeout)
+		# Only the latest timeout can fire, drop the one it supersedes rather than letting it wake up.
+		if self.timeout_timer:
+			self.unsched(self.timeout_timer)
+		self.timeout_timer = self.sched(ready_players, timeout)
+
 		self.broadcast({
 			'type': 'timeout',
 			'timeout': timeout*1000,
@@ -486,41 +871,123 @@ class Game(EventSystem):
 		pass
 
 	def broadcast_message(self, *args):
-		for player in self.players:
-			self.send(player, {
-				'type': 'message',
-				'message': {
-					'from': 'system',
-					'private': False,
-					'text': ' '.join(map(str,args))
-				}
-			})
+		self.broadcast({
+			'type': 'message',
+			'message': {
+				'from': 'system',
+				'private': False,
+				'text': ' '.join(map(str,args))
+			}
+		})
 
-	def send(self, player, obj):
+	def broadcast_combat_status(self):
+		"""Tell everyone where the combat stands, and how likely the players are to win from what everyone can see."""
+		self.broadcast({
+			'type': 'combat_status',
+			'players_total': self.combat.players_total(),
+			'monsters_total': self.combat.monsters_total(),
+			# Seeded from the game's seed rather than drawn from its rng, which the cards and public ids depend on.
+			'odds': odds.win_probability(self, rng=odds.seeded_rng(self.seed, self.action_number)),
+		})
+
+	def encode(self, obj):
+		obj = dict(obj)
+		obj['action_number'] = self.action_number
+
+		return wire.Message(obj)
+
+	def encode_around(self, obj, field):
+		"""A wire.Template of obj, whose fill adds field to it as a list of already encoded messages."""
 		obj = dict(obj)
 		obj['action_number'] = self.action_number
 
-		log.debug(str(player.id)+"> "+json.dumps(obj))
+		return wire.Template(obj, field)
+
+	def send(self, player, obj):
+		self.send_raw(player, self.encode(obj))
+
+	def send_raw(self, player, message):
+		if log.isEnabledFor(logging.DEBUG):
+			log.debug(str(player.id)+"> "+message.encode('json'))
 
 		if player.connection:
-			player.connection.write_message(json.dumps(obj))
+			player.connection.send(message)
 
-	def broadcast(self, obj):
+	def send_each(self, message_for, view_of):
+		"""Send every player message_for(player), encoding it once per distinct view_of(player)."""
+		encoded = {}
 		for player in self.players:
-			self.send(player, obj)
+			view = view_of(player)
+			if view not in encoded:
+				encoded[view] = self.encode(message_for(player))
 
-	def deal(self, player, deck, face_up=False, count=1):
-		for i in range(count):
-			card = deck.draw()
+			self.send_raw(player, encoded[view])
 
-			player.hand.append(card)
+	def broadcast(self, obj):
+		message = self.encode(obj)
+
+		for player in self.players:
+			self.send_raw(player, message)
 
-			for current_player in self.players:
-				self.send(current_player, {
+	def deal(self, player, deck, face_up=False, count=1):
+		self.deal_many({player: {deck: count}}, face_up)
+
+	def deal_many(self, counts, face_up=False):
+		"""Deal each player counts[player][deck] cards from each deck, then tell each player about all of it at once.
+
+		Players see the cards they were dealt, everyone else sees their backs unless face_up.
+		"""
+		dealt = []
+		for player, decks in counts.items():
+			hand = []
+			for deck, count in decks.items():
+				for i in range(count):
+					card = deck.draw()
+					if card is None:
+						break
+
+					player.hand.append(card)
+					hand.append(card)
+
+			dealt.append((player, hand))
+
+		# Each player's share is encoded once face up and once face down per format, then spliced into every message.
+		shares = {}
+		def share(player, hand, other_player):
+			visible = face_up or player == other_player
+			if (player, visible) not in shares:
+				shares[player, visible] = wire.Message({
 					'player': player.id,
-					'type': "draw",
-					'card': card.info() if player == current_player or face_up else deck.hidden_card(card.id).info(),
+					'cards': [card.info() if visible else card.deck.hidden_info(card.id) for card in hand],
 				})
+			return shares[player, visible]
+
+		template = self.encode_around({'type': "deal"}, 'hands')
+		for other_player in self.players:
+			self.send_raw(other_player, template.fill([share(player, hand, other_player) for player, hand in dealt]))
+
+def moves_delta(old, new):
+	"""Diff two get_valid_moves results.
+
+	Returns (add, remove), where add maps card id -> move -> targets for every move that is new or whose
+	targets changed, and remove maps card id -> moves that are no longer valid.
+	"""
+	add = defaultdict(dict)
+	remove = defaultdict(list)
+
+	for card_id, moves in new.items():
+		old_moves = old.get(card_id, {})
+		for move, targets in moves.items():
+			if old_moves.get(move) != targets:
+				add[card_id][move] = targets
+
+	for card_id, moves in old.items():
+		new_moves = new.get(card_id, {})
+		for move in moves:
+			if move not in new_moves:
+				remove[card_id].append(move)
+
+	return add, remove
 
 games = {}
 
@@ -529,9 +996,27 @@ import tornado.ioloop
 import tornado.options
 import tornado.httpserver
 import tornado.websocket
-from temp import FileHandler
+from temp import FileHandler, built_url
+
+tornado.options.define('game_log_dir', default=None, help="Log games here and recover them on startup")
+
+class CatalogueHandler(tornado.web.RequestHandler):
+	"""Serves cards.Card.catalogue at a url that changes with its version, so browsers can keep it forever."""
+
+	def get(self, version):
+		current, types = cards.Card.catalogue()
+		if version != current:
+			raise tornado.web.HTTPError(404)
+
+		self.set_header("Content-Type", "application/json")
+		self.set_header("Cache-Control", "max-age=31536000, public, immutable")
+		self.write(json.dumps(types))
+
+def catalogue_url():
+	return '/cards/%s.json' % cards.Card.catalogue()[0]
 
 application = tornado.web.Application([
+	(r"/cards/(\w+)\.json", CatalogueHandler),
 	(r"/(.*)", FileHandler),
 ])
 
@@ -539,36 +1024,90 @@ class ClientError(object):
 	def __init__(self, message):
 		self.message = "Invalid Move: " + message
 
+	def info(self):
+		return {
+			'type': "error",
+			'message': self.message,
+		}
+
 	def __str__(self):
-		return json.dumps({
-			type: "error",
-			message: self.message,
-		})
+		return json.dumps(self.info())
 
 class InvalidMove(ClientError):
 	pass
 
 
-class ClientSocket(tornado.websocket.WebSocketHandler):
-	def open(self, username, game_id, password):
-		username = username.decode('utf-8')
-		game_id = game_id.decode('utf-8')
-		
-		if password:
-			password = password.decode('utf-8')
+def text(value):
+	"""Older versions of tornado pass url arguments as bytes."""
+	if isinstance(value, bytes):
+		return value.decode('utf-8')
+	return value
+
+# Several messages sent as one, in order.
+BATCH = wire.Template({'type': "batch"}, 'messages')
+
+class GameClient(object):
+	"""The game side of a client connection, the transport provides write_message and close."""
+
+	# The wire format game messages are sent in, see wire.SUBPROTOCOLS.
+	wire_format = 'json'
+
+	# Set by refuse, the connection closes once its outbox has gone out.
+	closing = False
 
+	# Use a cached attribute so transports don't need to call __init__
+	@CachedAttribute
+	def outbox(self):
+		return []
+
+	def send(self, message):
+		"""Queue message. Everything queued during one turn of the IOLoop goes out together, as one frame."""
+		if not self.outbox:
+			tornado.ioloop.IOLoop.current().add_callback(self.flush_outbox)
+
+		self.outbox.append(message)
+
+	def flush_outbox(self):
+		outbox, self.outbox = self.outbox, []
+		message = outbox[0] if len(outbox) == 1 else BATCH.fill(outbox)
+
+		try:
+			self.write_message(message.encode(self.wire_format), binary=wire.is_binary(self.wire_format))
+		except tornado.websocket.WebSocketClosedError:
+			pass
+
+		if self.closing:
+			self.close()
+
+	def refuse(self, error):
+		"""Send error after everything already queued, then close the connection."""
+		self.send(wire.Message(error.info()))
+		self.closing = True
+
+	def join(self, username, game_id, password):
 		global games
+
+		# Sent before anything that shows a card, so clients can look up the card types it uses.
+		self.send(wire.Message({
+			'type': 'catalogue',
+			'version': cards.Card.catalogue()[0],
+			'url': catalogue_url(),
+			# Where to find the card art sprite atlas, if build_assets.py made one.
+			'atlas': built_url('atlas.json'),
+		}))
+
 		if game_id not in games:
 			games[game_id] = Game(password)
+			if tornado.options.options.game_log_dir:
+				gamelog.attach(games[game_id], tornado.options.options.game_log_dir, game_id)
 			if 'AI' in game_id:
-				games[game_id].add_player(AI('ROBOT', self))
+				games[game_id].submit(games[game_id].add_player, AI('ROBOT', games[game_id]))
 			
 		game = games[game_id]
 		self.game = game
 
 		if game.password and game.password != password:
-			self.write_message(ClientError(_("Wrong password")))
-			self.close()
+			self.refuse(ClientError(_("Wrong password")))
 			return
 
 		if game.started:
@@ -578,21 +1117,23 @@ class ClientSocket(tornado.websocket.WebSocketHandler):
 					self.player = player
 					player.connected = True
 					player.connection = self
-					game.update_players()
+					game.submit(game.update_players)
 					return
 
-			self.write_message(ClientError(_("Cannot join game, already in progress.")))
-			self.close()
+			self.refuse(ClientError(_("Cannot join game, already in progress.")))
 			return
 
 		player = Player(username, self)
-		game.add_player(player)
+		game.submit(game.add_player, player)
 
 		self.player = player
 
 		log.debug(username+"joined"+game_id)
 
 	def on_message(self, message):
+		self.game.submit(self.handle_message, message)
+
+	def handle_message(self, message):
 		log.debug(str(self.player.id)+'<'+message)
 		message = json.loads(message)
 	
@@ -605,16 +1146,30 @@ class ClientSocket(tornado.websocket.WebSocketHandler):
 				log.debug("Invalid move: "+json.dumps(message))
 				self.write_message("INVALID MOVE")
 				return
-		elif if message['type'] == "READY":
+		elif message['type'] == "READY":
 			self.game.ready(self.player)
 
 	def on_close(self):
-		if hasattr(self, 'game'):
-			if self.game.started:
-				self.player.connected = False
-				self.player.connection = None
-			else:
-				self.game.players.remove(self.player)
+		# Refused connections never got a player.
+		if hasattr(self, 'player'):
+			self.game.submit(self.leave)
+
+	def leave(self):
+		if self.game.started:
+			self.player.connected = False
+			self.player.connection = None
+		else:
+			self.game.remove_player(self.player)
+
+class ClientSocket(GameClient, tornado.websocket.WebSocketHandler):
+	def select_subprotocol(self, subprotocols):
+		for subprotocol in subprotocols:
+			if subprotocol in wire.SUBPROTOCOLS:
+				self.wire_format = wire.SUBPROTOCOLS[subprotocol]
+				return subprotocol
+
+	def open(self, username, game_id, password):
+		self.join(text(username), text(game_id), password and text(password))
 
 socket_app = tornado.web.Application([
 	(r"/socket/(?P<username>\w+)/(?P<game_id>\w+)(?:/(?P<password>\w+))?", ClientSocket),
@@ -622,7 +1177,9 @@ socket_app = tornado.web.Application([
 
 if __name__ == '__main__':
 	try:
-		tornado.options.enable_pretty_logging()
+		tornado.options.parse_command_line()
+		if tornado.options.options.game_log_dir:
+			games.update(gamelog.recover(tornado.options.options.game_log_dir, Game))
 		http_server = tornado.httpserver.HTTPServer(application)
 		http_server.listen(8888)
 		socket_app.listen(800)
@@ -0,0 +1,197 @@
+"""Shard games across worker processes.
+
+The router accepts websocket connections on the same urls as server.py and forwards each one to the worker that
+owns its game, picked from a hash of the game id. Router and workers talk over local TCP, one json list per line:
+
+	router -> worker: ["open", conn_id, username, game_id, password, wire_format], ["message", conn_id, text],
+		["close", conn_id]
+	worker -> router: ["write", conn_id, text], ["write_binary", conn_id, base64], ["close", conn_id]
+
+The router negotiates the client's wire format, see wire.py, and the worker encodes for it.
+
+Run with `python shard.py --workers=4`.
+"""
+import json
+import zlib
+import base64
+import logging
+import itertools
+import multiprocessing
+
+import tornado.web
+import tornado.gen
+import tornado.ioloop
+import tornado.options
+import tornado.iostream
+import tornado.tcpclient
+import tornado.tcpserver
+import tornado.websocket
+import tornado.httpserver
+
+import server
+
+log = logging.getLogger("MunchkinServer")
+
+tornado.options.define('workers', default=4, help="Number of worker processes to shard games across")
+tornado.options.define('port', default=800, help="Websocket port the router listens on")
+tornado.options.define('http_port', default=8888, help="Port static files are served on")
+tornado.options.define('worker_port', default=9000, help="Local port of the first worker, the rest follow it")
+
+def shard_for(game_id, workers):
+	"""Index of the worker that owns game_id. Unlike hash() this is the same in every process."""
+	return zlib.crc32(game_id.encode('utf-8')) % workers
+
+def encode(*args):
+	return json.dumps(args).encode('utf-8') + b'\n'
+
+class RemoteClient(server.GameClient):
+	"""A client connected to the router, as seen by the worker that owns its game."""
+
+	def __init__(self, stream, conn_id, wire_format='json'):
+		self.stream, self.conn_id = stream, conn_id
+		self.wire_format = wire_format
+
+	def write_message(self, message, binary=False):
+		if self.stream.closed():
+			return
+
+		if binary:
+			self.stream.write(encode('write_binary', self.conn_id, base64.b64encode(message).decode('ascii')))
+		else:
+			self.stream.write(encode('write', self.conn_id, message))
+
+	def close(self):
+		if not self.stream.closed():
+			self.stream.write(encode('close', self.conn_id))
+
+class WorkerServer(tornado.tcpserver.TCPServer):
+	async def handle_stream(self, stream, address):
+		clients = {}
+
+		try:
+			while True:
+				event, conn_id, *args = json.loads(await stream.read_until(b'\n'))
+
+				if event == 'open':
+					username, game_id, password, wire_format = args
+					clients[conn_id] = RemoteClient(stream, conn_id, wire_format)
+					clients[conn_id].join(username, game_id, password)
+				elif event == 'message':
+					clients[conn_id].on_message(*args)
+				elif event == 'close':
+					clients.pop(conn_id).on_close()
+		except tornado.iostream.StreamClosedError:
+			# Lost the router, so every client it was forwarding has gone too.
+			for client in clients.values():
+				client.on_close()
+
+class WorkerLink(object):
+	"""The router's connection to one worker."""
+
+	def __init__(self, port):
+		self.port = port
+		self.stream = None
+		self.sockets = {}
+
+	@property
+	def alive(self):
+		return self.stream is not None and not self.stream.closed()
+
+	async def connect(self):
+		# The worker may not be listening yet.
+		while not self.stream:
+			try:
+				self.stream = await tornado.tcpclient.TCPClient().connect('127.0.0.1', self.port)
+			except tornado.iostream.StreamClosedError:
+				await tornado.gen.sleep(0.1)
+
+		tornado.ioloop.IOLoop.current().spawn_callback(self.read)
+
+	async def read(self):
+		try:
+			while True:
+				event, conn_id, *args = json.loads(await self.stream.read_until(b'\n'))
+				socket = self.sockets.get(conn_id)
+
+				if not socket:
+					continue
+
+				try:
+					if event == 'write':
+						socket.write_message(*args)
+					elif event == 'write_binary':
+						socket.write_message(base64.b64decode(args[0]), binary=True)
+					elif event == 'close':
+						socket.close()
+				except tornado.websocket.WebSocketClosedError:
+					pass
+		except tornado.iostream.StreamClosedError:
+			log.error('Lost the worker on port %d', self.port)
+			self.lost()
+
+	def lost(self):
+		"""Close every socket forwarded to a worker that has gone, along with the games it was running."""
+		sockets, self.sockets = self.sockets, {}
+		for socket in sockets.values():
+			socket.close(1011, "Game server unavailable")
+
+	def send(self, *args):
+		# Writes after the worker has gone are dropped, read closes every socket on the link when it notices.
+		if self.alive:
+			self.stream.write(encode(*args))
+
+links = []
+connection_ids = itertools.count()
+
+class RouterSocket(tornado.websocket.WebSocketHandler):
+	wire_format = 'json'
+
+	select_subprotocol = server.ClientSocket.select_subprotocol
+
+	def open(self, username, game_id, password):
+		game_id = server.text(game_id)
+
+		self.conn_id = next(connection_ids)
+		self.link = links[shard_for(game_id, len(links))]
+		if not self.link.alive:
+			self.close(1011, "Game server unavailable")
+			return
+
+		self.link.sockets[self.conn_id] = self
+		self.link.send(
+			'open', self.conn_id, server.text(username), game_id, password and server.text(password), self.wire_format,
+		)
+
+	def on_message(self, message):
+		self.link.send('message', self.conn_id, message)
+
+	def on_close(self):
+		if hasattr(self, 'link') and self.link.sockets.pop(self.conn_id, None):
+			self.link.send('close', self.conn_id)
+
+router_app = tornado.web.Application([
+	(r"/socket/(?P<username>\w+)/(?P<game_id>\w+)(?:/(?P<password>\w+))?", RouterSocket),
+])
+
+def run_worker(port):
+	WorkerServer().listen(port, '127.0.0.1')
+	tornado.ioloop.IOLoop.current().start()
+
+def run_router(workers, port, http_port, worker_port):
+	for i in range(workers):
+		multiprocessing.Process(target=run_worker, args=(worker_port+i,), daemon=True).start()
+
+	links[:] = [WorkerLink(worker_port+i) for i in range(workers)]
+
+	iol = tornado.ioloop.IOLoop.current()
+	iol.run_sync(lambda: tornado.gen.multi([link.connect() for link in links]))
+
+	tornado.httpserver.HTTPServer(server.application).listen(http_port)
+	router_app.listen(port)
+	log.debug('Routing port %d to %d workers', port, workers)
+	iol.start()
+
+if __name__ == '__main__':
+	tornado.options.parse_command_line()
+	options = tornado.options.options
+	run_router(options.workers, options.port, options.http_port, options.worker_port)
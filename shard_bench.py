@@ -0,0 +1,91 @@
+"""Measure aggregate throughput of shard.py for different numbers of workers.
+
+For each worker count this starts the router, fills it with two player games whose clients ready up as fast as
+the server acknowledges them, and reports acknowledged readies per second across every game.
+
+Run with `python shard_bench.py --worker_counts=1,2,4 --games=50 --duration=5`.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+
+import tornado.gen
+import tornado.ioloop
+import tornado.options
+import tornado.websocket
+
+tornado.options.define('worker_counts', default=[1, 2, 4], multiple=True, type=int, help="Worker counts to compare")
+tornado.options.define('games', default=50, help="Concurrent two player games")
+tornado.options.define('duration', default=5.0, help="Seconds to measure each worker count for")
+tornado.options.define('port', default=8800, help="Port to run the router on")
+
+async def connect(url):
+	# The router takes a moment to start.
+	for attempt in range(100):
+		try:
+			return await tornado.websocket.websocket_connect(url)
+		except (ConnectionError, OSError):
+			await tornado.gen.sleep(0.1)
+
+	raise Exception("Couldn't connect to "+url)
+
+async def play(port, game_id, username, counts, deadline):
+	conn = await connect('ws://127.0.0.1:%d/socket/%s/%s' % (port, username, game_id))
+	ready_text = username + " is ready"
+
+	while time.time() < deadline:
+		conn.write_message(json.dumps({'type': 'READY'}))
+
+		while True:
+			message = await conn.read_message()
+			if message is None:
+				return
+
+			message = json.loads(message)
+			messages = message['messages'] if message['type'] == 'batch' else [message]
+			if any(message['type'] == 'message' and message['message']['text'] == ready_text for message in messages):
+				break
+
+		counts[0] += 1
+
+	conn.close()
+
+def measure(workers, games, duration, port):
+	router = subprocess.Popen(
+		[sys.executable, 'shard.py', '--workers=%d' % workers, '--port=%d' % port,
+			'--http_port=%d' % (port+1), '--worker_port=%d' % (port+100)],
+		cwd=os.path.dirname(os.path.abspath(__file__)),
+		start_new_session=True,
+		stderr=subprocess.DEVNULL,
+	)
+
+	try:
+		counts = [0]
+
+		async def run():
+			# Wait for the router before starting the clock.
+			(await connect('ws://127.0.0.1:%d/socket/warmup/warmup' % port)).close()
+
+			deadline = time.time() + duration
+			await tornado.gen.multi([
+				play(port, 'bench%d' % game, 'player%d' % seat, counts, deadline)
+				for game in range(games) for seat in range(2)
+			])
+
+		tornado.ioloop.IOLoop.current().run_sync(run)
+		return counts[0] / duration
+	finally:
+		os.killpg(router.pid, signal.SIGTERM)
+		router.wait()
+
+if __name__ == '__main__':
+	tornado.options.parse_command_line()
+	options = tornado.options.options
+
+	print("workers  readies/sec")
+	for workers in options.worker_counts:
+		print("%7d  %11.1f" % (workers, measure(workers, options.games, options.duration, options.port)))
+		sys.stdout.flush()
@@ -0,0 +1,138 @@
+"""Play whole games between bots without a server, and time the engine while doing it.
+
+Every seat is an ai.AI bot using the chosen policy. Timeouts never fire, a game runs until someone reaches
+level 10, the bots stop acting, or max_actions is hit.
+
+Run with `python simulate.py --games=50 --players=4 --seed=1 --policy=random`.
+"""
+import time
+import random
+import logging
+
+import tornado.options
+
+import ai
+import server
+from enums import Phases
+
+tornado.options.define('games', default=50, help="Number of games to play")
+tornado.options.define('players', default=4, help="Bots per game")
+tornado.options.define('seed', default=1, help="Seed for the first game, each later game adds one")
+tornado.options.define('max_actions', default=2000, help="Give up on a game after this many actions")
+tornado.options.define('policy', default='random', help="Bot policy: random, greedy, lookahead or odds")
+
+policies = {
+	'random': ai.RandomPolicy,
+	'greedy': ai.GreedyPolicy,
+	'lookahead': ai.LookaheadPolicy,
+	'odds': ai.OddsPolicy,
+}
+
+class HeadlessLoop(object):
+	"""Enough of an IOLoop for a Game. Callbacks run when run_callbacks is called, timeouts never fire."""
+
+	def __init__(self):
+		self.callbacks = []
+
+	def add_callback(self, callback, *args):
+		self.callbacks.append((callback, args))
+
+	def call_later(self, delay, callback, *args):
+		return (callback, args)
+
+	def remove_timeout(self, handle):
+		pass
+
+	def run_callback(self):
+		callback, args = self.callbacks.pop(0)
+		callback(*args)
+
+class Timings(object):
+	def __init__(self):
+		self.samples = {}
+
+	def add(self, name, duration):
+		self.samples.setdefault(name, []).append(duration)
+
+	def percentile(self, name, fraction):
+		samples = sorted(self.samples.get(name, []))
+		if not samples:
+			return 0.0
+		return samples[min(len(samples)-1, int(len(samples)*fraction))]
+
+	def count(self, name):
+		return len(self.samples.get(name, []))
+
+def timed(name, action=False):
+	"""Wrap a Game method so every call is recorded in the game's timings, and optionally counted as an action."""
+	def wrapper(self, *args, **kwargs):
+		if action:
+			self.actions_taken += 1
+
+		start = time.perf_counter()
+		try:
+			return getattr(server.Game, name)(self, *args, **kwargs)
+		finally:
+			self.timings.add(name, time.perf_counter() - start)
+
+	return wrapper
+
+class TimedGame(server.Game):
+	play_move = timed('play_move', action=True)
+	ready = timed('ready', action=True)
+	get_valid_moves = timed('get_valid_moves')
+	broadcast = timed('broadcast')
+
+	def __init__(self, timings, *args, **kwargs):
+		self.timings = timings
+		self.actions_taken = 0
+		super().__init__(*args, **kwargs)
+
+def finished(game):
+	return game.phase == Phases.END or any(player.level >= 10 for player in game.players)
+
+def play_game(seed, players=4, max_actions=2000, timings=None, policy='random'):
+	"""Play one game between bots. Returns (game, actions taken)."""
+	timings = timings or Timings()
+	rng = random.Random(seed)
+
+	loop = HeadlessLoop()
+	game = TimedGame(timings, io_loop=loop, seed=seed)
+
+	for i in range(players):
+		bot_policy = ai.RandomPolicy(rng) if policy == 'random' else policies[policy]()
+		game.add_player(ai.AI('bot%d' % i, game, bot_policy))
+
+	while loop.callbacks and game.actions_taken < max_actions and not finished(game):
+		loop.run_callback()
+
+	return game, game.actions_taken
+
+def run(games, players, seed, max_actions, policy):
+	timings = Timings()
+	total_actions = 0
+
+	start = time.perf_counter()
+	for i in range(games):
+		game, actions = play_game(seed+i, players, max_actions, timings, policy)
+		total_actions += actions
+	elapsed = time.perf_counter() - start
+
+	return elapsed, total_actions, timings
+
+if __name__ == '__main__':
+	tornado.options.parse_command_line()
+	options = tornado.options.options
+	logging.getLogger("MunchkinServer").setLevel(logging.WARNING)
+
+	elapsed, actions, timings = run(options.games, options.players, options.seed, options.max_actions, options.policy)
+
+	print("%d games of %d %s players, %d actions in %.2fs" % (
+		options.games, options.players, options.policy, actions, elapsed,
+	))
+	print("%.2f games/sec, %.1f actions/sec" % (options.games / elapsed, actions / elapsed))
+	print("%-16s %8s %10s %10s" % ("", "calls", "p50 ms", "p99 ms"))
+	for name in ('play_move', 'get_valid_moves', 'broadcast'):
+		print("%-16s %8d %10.3f %10.3f" % (
+			name, timings.count(name), timings.percentile(name, 0.5)*1000, timings.percentile(name, 0.99)*1000,
+		))
@@ -1,20 +1,174 @@
 import tornado.web
+import email.utils
 import mimetypes
+import datetime
+import hashlib
+import json
 import os.path
+import mmap
+import stat
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Files up to this size are kept in memory, bigger ones are mapped and streamed from the page cache.
+MAX_CACHED_SIZE = 256 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# Where build_assets.py puts its output.
+BUILD_DIR = os.path.join(ROOT, 'build')
+MANIFEST = os.path.join(BUILD_DIR, 'manifest.json')
+# Content-Encoding -> suffix of the precompressed variant, in order of preference.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+class Asset(object):
+    """A static file as it was at one (mtime, size), with its headers worked out once."""
+
+    def __init__(self, path, info):
+        self.path = path
+        self.stamp = (info.st_mtime_ns, info.st_size)
+        self.mtime = int(info.st_mtime)
+        self.last_modified = datetime.datetime.fromtimestamp(self.mtime, datetime.timezone.utc)
+        self.mime_type = mimetypes.guess_type(path)[0] or 'text/plain'
+
+        with open(path, 'rb') as f:
+            if info.st_size <= MAX_CACHED_SIZE:
+                self.data = f.read()
+                self.etag = '"%s"' % hashlib.sha1(self.data).hexdigest()
+            else:
+                # The mapping outlives the file handle.
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.etag = '"%x-%x"' % self.stamp
+
+    @property
+    def streamed(self):
+        return isinstance(self.data, mmap.mmap)
+
+# Absolute path -> Asset.
+assets = {}
+
+def get_asset(path):
+    """The Asset for path, reloaded if the file has changed since it was cached, or None if it isn't a file."""
+    try:
+        info = os.stat(path)
+    except OSError:
+        info = None
+
+    if info is None or not stat.S_ISREG(info.st_mode):
+        assets.pop(path, None)
+        return None
+
+    asset = assets.get(path)
+    if asset is None or asset.stamp != (info.st_mtime_ns, info.st_size):
+        asset = assets[path] = Asset(path, info)
+
+    return asset
+
+# (the manifest's Asset, its contents), reparsed when the Asset is reloaded.
+manifest = (None, {'files': {}, 'sources': {}})
+
+def get_manifest():
+    """What build_assets.py last built: 'files', built name -> {'encodings', 'immutable'}, and 'sources', source
+    name -> built name. Empty if it hasn't been run.
+    """
+    global manifest
+
+    asset = get_asset(MANIFEST)
+    if asset is None:
+        return {'files': {}, 'sources': {}}
+
+    if asset is not manifest[0]:
+        manifest = (asset, json.loads(asset.data.decode('utf-8')))
+
+    return manifest[1]
+
+def built_url(source):
+    """The url source is served at once built, or None if it hasn't been."""
+    name = get_manifest()['sources'].get(source)
+    return name and '/' + name
 
 class FileHandler(tornado.web.RequestHandler):
-    def get(self, path):
+    async def get(self, path):
         if not path:
             path = 'index.html'
 
-        if not os.path.exists(path):
+        built = get_manifest()['files'].get(path)
+        if built:
+            asset = self.built_variant(path, built)
+            mime_type = mimetypes.guess_type(path)[0] or 'text/plain'
+            # Built names change with their contents, apart from index.html, which has to be checked every time.
+            cache_control = "max-age=31536000, public, immutable" if built['immutable'] else "no-cache"
+        else:
+            path = os.path.abspath(os.path.join(ROOT, path))
+            if not path.startswith(ROOT + os.sep):
+                raise tornado.web.HTTPError(404)
+
+            asset = get_asset(path)
+            mime_type = asset and asset.mime_type
+            cache_control = "max-age=604800, public"
+
+        if asset is None:
             raise tornado.web.HTTPError(404)
 
-        mime_type = mimetypes.guess_type(path)
-        self.set_header("Content-Type", mime_type[0] or 'text/plain')
-        self.set_header("Cache-Control", "max-age=604800, public")
+        self.set_header("Content-Type", mime_type)
+        self.set_header("Cache-Control", cache_control)
+        self.set_header("ETag", asset.etag)
+        self.set_header("Last-Modified", asset.last_modified)
+
+        if self.not_modified(asset):
+            self.set_status(304)
+            return
+
+        if not asset.streamed:
+            self.write(asset.data)
+            return
+
+        self.set_header("Content-Length", len(asset.data))
+        with memoryview(asset.data) as view:
+            for start in range(0, len(view), CHUNK_SIZE):
+                self.write(bytes(view[start:start+CHUNK_SIZE]))
+                await self.flush()
+
+    def built_variant(self, name, built):
+        """The Asset of the smallest variant of a built file the client accepts."""
+        self.set_header("Vary", "Accept-Encoding")
+        accepted = self.accepted_encodings()
+
+        for encoding, suffix in ENCODINGS:
+            if encoding in built['encodings'] and encoding in accepted:
+                asset = get_asset(os.path.join(BUILD_DIR, name + suffix))
+                if asset is not None:
+                    self.set_header("Content-Encoding", encoding)
+                    return asset
+
+        return get_asset(os.path.join(BUILD_DIR, name))
+
+    def accepted_encodings(self):
+        accepted = set()
+
+        for part in self.request.headers.get("Accept-Encoding", "").split(','):
+            coding, _, params = part.partition(';')
+            params = params.replace(' ', '')
+
+            try:
+                quality = float(params[2:]) if params.startswith('q=') else 1.0
+            except ValueError:
+                quality = 1.0
+
+            if quality > 0:
+                accepted.add(coding.strip().lower())
+
+        return accepted
+
+    def not_modified(self, asset):
+        # If-None-Match wins over If-Modified-Since when a client sends both.
+        if "If-None-Match" in self.request.headers:
+            return self.check_etag_header()
+
+        since = self.request.headers.get("If-Modified-Since")
+        if not since:
+            return False
 
-        outfile = open(path, 'rb')
-        for line in outfile:
-            self.write(line)
-        self.finish()
+        try:
+            return asset.mtime <= email.utils.parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
@@ -0,0 +1,50 @@
+"""Bot policies."""
+import random
+import logging
+
+import ai
+import odds
+import cards
+import server
+import simulate
+from enums import Moves, Phases
+from moves import Move
+
+def combat(monkeypatch, seed=1):
+	"""A two bot game stopped at its first combat, in which combat cards are worth 2."""
+	monkeypatch.setattr(cards.CombatOneShot, 'bonus', 2)
+	logging.getLogger("MunchkinServer").setLevel(logging.WARNING)
+
+	rng = random.Random(seed)
+	loop = simulate.HeadlessLoop()
+	game = server.Game(io_loop=loop, seed=seed)
+	for i in range(2):
+		game.add_player(ai.AI('bot%d' % i, game, ai.RandomPolicy(rng, play_chance=0)))
+
+	while game.phase != Phases.COMBAT:
+		loop.run_callback()
+
+	return game
+
+def test_odds_policy_plays_what_raises_its_chances(monkeypatch):
+	game = combat(monkeypatch)
+	bot = next(player for player in game.players if player not in game.combat.players)
+	options = bot.options()
+	assert options
+
+	card, move_type, target = ai.OddsPolicy().choose(game, bot, options)
+	assert (move_type, target) == (Moves.PLAY, 'combat_monsters')
+
+	# Someone not in the fight wants the monsters to win, and the play makes that likelier.
+	rng = odds.seeded_rng(0)
+	before = odds.win_probability(game, viewer=bot, rollouts=20000, rng=rng)
+	game.play_move(Move(game, move_type, bot, card, target))
+	assert odds.win_probability(game, viewer=bot, rollouts=20000, rng=rng) < before
+
+def test_odds_policy_holds_cards_that_change_nothing(monkeypatch):
+	game = combat(monkeypatch)
+	# Only the fighter's own card helps, and it can't close the gap on its own.
+	fighter = game.combat.players[0]
+	assert game.combat.margin() + 2 <= 0
+
+	assert ai.OddsPolicy().choose(game, fighter, fighter.options()) is None
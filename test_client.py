@@ -0,0 +1,34 @@
+"""What a connection is sent when it joins."""
+import json
+import logging
+
+import tornado.ioloop
+
+import server
+import simulate
+
+class RecordingClient(server.GameClient):
+	def __init__(self):
+		self.sent = []
+
+	def write_message(self, message, binary=False):
+		self.sent.append(json.loads(message))
+
+	def close(self):
+		self.sent.append('closed')
+
+def test_join_errors_come_after_the_catalogue(monkeypatch):
+	logging.getLogger("MunchkinServer").setLevel(logging.WARNING)
+	monkeypatch.setattr(server, 'games', {'locked': server.Game('secret', simulate.HeadlessLoop())})
+	loop = tornado.ioloop.IOLoop()
+	client = RecordingClient()
+
+	loop.run_sync(lambda: client.join('alice', 'locked', 'guess'))
+	loop.run_sync(lambda: None)
+	loop.close()
+
+	# Both go out in one batch, so the client knows the card types before it gets to the error.
+	batch, closed = client.sent
+	assert [message['type'] for message in batch['messages']] == ['catalogue', 'error']
+	assert closed == 'closed'
+	assert not hasattr(client, 'player')
@@ -0,0 +1,38 @@
+"""websocket.FrameParser, checked against decode_hybi. frame_bench.py times the two."""
+import pytest
+
+import websocket
+from frame_bench import encode, fuzz, new_decode
+
+def test_matches_decode_hybi_on_random_streams():
+	fuzz(300, seed=1)
+
+def test_joins_fragments_around_control_frames():
+	stream = encode(0x1, b'hel', fin=False) + encode(0x9, b'ping') + encode(0x0, b'lo', fin=False) \
+		+ encode(0x0, b'!') + encode(0x8, b'\x03\xe8')
+	reads = [stream[i:i+1] for i in range(len(stream))]
+
+	assert new_decode(reads) == [(0x9, b'ping', None), (0x1, b'hello!', None), (0x8, b'\x03\xe8', (1000, ''))]
+
+def test_waits_for_whole_frames():
+	parser = websocket.FrameParser()
+	frame = encode(0x2, b'x' * 70000)
+
+	parser.feed(frame[:-1])
+	assert list(parser.frames()) == []
+	assert parser.pending() == len(frame) - 1
+
+	parser.feed(frame[-1:])
+	assert [f.payload for f in parser.frames()] == [b'x' * 70000]
+	assert parser.pending() == 0
+
+@pytest.mark.parametrize('stream', [
+	encode(0x0, b'no message to continue'),
+	encode(0x1, b'unfinished', fin=False) + encode(0x1, b'new message'),
+])
+def test_rejects_bad_fragments(stream):
+	parser = websocket.FrameParser()
+	parser.feed(stream)
+
+	with pytest.raises(websocket.WebSocketServer.CClose):
+		list(parser.frames())
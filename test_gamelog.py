@@ -0,0 +1,73 @@
+"""Recovering games from their logs."""
+import os
+import random
+import logging
+
+import ai
+import server
+import gamelog
+import simulate
+from player import Player
+
+def logged_game(directory, seed=1, actions=300):
+	"""A bot game logged to directory, stopped between actions with everything written."""
+	logging.getLogger("MunchkinServer").setLevel(logging.WARNING)
+	rng = random.Random(seed)
+	loop = simulate.HeadlessLoop()
+	game = server.Game(io_loop=loop, seed=seed)
+	gamelog.attach(game, directory, 'game')
+	game.event_log.snapshot_every = 50
+
+	for i in range(3):
+		game.add_player(ai.AI('bot%d' % i, game, ai.RandomPolicy(rng)))
+
+	for i in range(actions):
+		if not loop.callbacks or simulate.finished(game):
+			break
+		loop.run_callback()
+
+	game.actions.clear()
+	close_writer()
+	return game
+
+def close_writer():
+	gamelog.writer.close()
+	gamelog.writer = None
+
+def recover(directory):
+	games = gamelog.recover(directory, server.Game, simulate.HeadlessLoop())
+	close_writer()
+	return games
+
+def test_recovers_from_newest_segment(tmp_path):
+	game = logged_game(str(tmp_path))
+	recovered = recover(str(tmp_path))['game']
+
+	assert recovered.snapshot() == game.snapshot()
+
+def test_falls_back_when_newest_segment_has_no_snapshot(tmp_path):
+	directory = str(tmp_path)
+	game = logged_game(directory)
+	(segment, path), = gamelog.segments(directory)['game']
+
+	# A crash while starting the next segment, before its snapshot was all written.
+	with open(os.path.join(directory, 'game.%d.log' % (segment + 1)), 'w') as f:
+		f.write('["snapshot", {"seed": ')
+
+	recovered = recover(directory)['game']
+
+	assert recovered.snapshot() == game.snapshot()
+	# Carries on logging in a segment of its own, with the ones it was recovered from gone.
+	assert [number for number, path in gamelog.segments(directory)['game']] == [segment + 1]
+	assert recover(directory)['game'].snapshot() == game.snapshot()
+
+def test_lobby_drops_humans_that_have_to_join_again(tmp_path):
+	directory = str(tmp_path)
+	game = server.Game(io_loop=simulate.HeadlessLoop())
+	gamelog.attach(game, directory, 'lobby')
+	game.add_player(Player('alice', None))
+	close_writer()
+
+	assert recover(directory)['lobby'].players == []
+	# Dropping them was logged too.
+	assert recover(directory)['lobby'].players == []
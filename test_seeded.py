@@ -0,0 +1,53 @@
+"""Games on the same seed send the same messages, so a trace of one can be replayed exactly."""
+import random
+import logging
+
+import pytest
+
+import ai
+import odds
+import cards
+import server
+import simulate
+
+class RecordingGame(server.Game):
+	def __init__(self, *args, **kwargs):
+		self.actions_taken = 0
+		self.trace = []
+		super().__init__(*args, **kwargs)
+
+	def send_raw(self, player, message):
+		self.trace.append((player.name, message.encode('json')))
+		super().send_raw(player, message)
+
+	def play_move(self, move):
+		self.actions_taken += 1
+		super().play_move(move)
+
+def trace(seed, players=4, max_actions=600):
+	logging.getLogger("MunchkinServer").setLevel(logging.WARNING)
+	rng = random.Random(seed)
+	loop = simulate.HeadlessLoop()
+	game = RecordingGame(io_loop=loop, seed=seed)
+
+	for i in range(players):
+		game.add_player(ai.AI('bot%d' % i, game, ai.RandomPolicy(rng)))
+
+	while loop.callbacks and game.actions_taken < max_actions and not simulate.finished(game):
+		loop.run_callback()
+
+	return game.trace
+
+@pytest.mark.parametrize('with_numpy', [True, False])
+def test_same_seed_same_trace(monkeypatch, with_numpy):
+	if not with_numpy:
+		monkeypatch.setattr(odds, 'numpy', None)
+	# Combat cards that move the totals, so the odds in combat_status come from rollouts rather than the margin.
+	monkeypatch.setattr(cards.CombatOneShot, 'bonus', 2)
+
+	first = trace(3)
+	rolled = [message for name, message in first if '"combat_status"' in message and '"odds": 1.0' not in message
+		and '"odds": 0.0' not in message]
+	assert rolled, "no combat_status came from rollouts"
+
+	assert trace(3) == first
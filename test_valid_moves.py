@@ -0,0 +1,82 @@
+"""Check the indexed Game.get_valid_moves against the brute force search it replaced.
+
+Seeded bot games are played out with simulate.HeadlessLoop, and after every action both searches have to give
+the same moves, in the same order, for every player.
+"""
+import random
+import logging
+from collections import defaultdict
+
+import ai
+import server
+import simulate
+from enums import Moves, Phases
+
+SEEDS = range(1, 6)
+PLAYERS = 4
+MAX_ACTIONS = 400
+
+def brute_force_valid_moves(game, player):
+	"""Every card the player holds, against every move and every possible target."""
+	potential = [move for move in game.potential_moves(game.phase)]
+	valid = defaultdict(lambda: defaultdict(list))
+	if Moves.DONE in potential:
+		valid[None][Moves.DONE].append(None)
+		potential.remove(Moves.DONE)
+
+	phase_specific_targets = ["combat_monsters", "combat_players"] if game.phase == Phases.COMBAT else []
+
+	for move in potential:
+		for card in player.all_cards:
+			for target in [None] + game.all_cards(player) + phase_specific_targets:
+				if card.can_play(move, target, game.phase, game.is_turn(player)):
+					valid[card.id][move].append(target.info() if hasattr(target, "info") else target)
+
+	return valid
+
+def ordered(valid):
+	return [(card_id, list(moves.items())) for card_id, moves in valid.items()]
+
+class CheckedGame(server.Game):
+	"""Compares both searches for every player after each action."""
+
+	def __init__(self, *args, **kwargs):
+		self.actions_taken = 0
+		self.checked = 0
+		super().__init__(*args, **kwargs)
+
+	def check(self):
+		for player in self.players:
+			expected = ordered(brute_force_valid_moves(self, player))
+			assert ordered(self.get_valid_moves(player)) == expected, (self.action_number, player.name)
+			self.checked += 1
+
+	def play_move(self, move):
+		super().play_move(move)
+		self.actions_taken += 1
+		self.check()
+
+	def ready(self, player):
+		super().ready(player)
+		self.actions_taken += 1
+		self.check()
+
+def play(seed):
+	rng = random.Random(seed)
+	loop = simulate.HeadlessLoop()
+	game = CheckedGame(io_loop=loop, seed=seed)
+
+	for i in range(PLAYERS):
+		game.add_player(ai.AI('bot%d' % i, game, ai.RandomPolicy(rng)))
+
+	while loop.callbacks and game.actions_taken < MAX_ACTIONS and not simulate.finished(game):
+		loop.run_callback()
+
+	return game
+
+def test_indexed_matches_brute_force():
+	logging.getLogger("MunchkinServer").setLevel(logging.WARNING)
+
+	for seed in SEEDS:
+		game = play(seed)
+		assert game.checked > 0
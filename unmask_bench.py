@@ -0,0 +1,75 @@
+"""Measure how long websocket.py takes to unmask frame payloads of different sizes.
+
+For each payload size this times WebSocketServer.unmask with numpy and without it, given the frame as bytes and
+as a memoryview, next to a byte at a time loop for reference. Every way has to give the same bytes.
+
+Run with `python unmask_bench.py --sizes=10,1024,1048576`.
+"""
+import os
+import timeit
+
+import tornado.options
+
+import websocket
+
+tornado.options.define('sizes', default=[10, 100, 1024, 10240, 102400, 1048576], multiple=True, type=int,
+	help="Payload sizes to compare, in bytes")
+tornado.options.define('seconds', default=0.2, help="Roughly how long to time each way for")
+
+HEADER = 2
+
+def frame(size):
+	"""A masked frame's header, mask and payload: the same shape recv_frames hands to unmask."""
+	return os.urandom(HEADER + 4 + size)
+
+def loop_unmask(buf, hlen, plen):
+	mask = buf[hlen:hlen+4]
+	return bytes(b ^ mask[i % 4] for i, b in enumerate(buf[hlen+4:hlen+4+plen]))
+
+def with_numpy(buf, hlen, plen):
+	websocket.WebSocketServer.numpy_unmask_min = 0
+	return websocket.WebSocketServer.unmask(buf, hlen, plen)
+
+def without_numpy(buf, hlen, plen):
+	websocket.WebSocketServer.numpy_unmask_min = float('inf')
+	return websocket.WebSocketServer.unmask(buf, hlen, plen)
+
+WAYS = [
+	('int', without_numpy, bytes),
+	('int view', without_numpy, memoryview),
+	('numpy', with_numpy, bytes),
+	('numpy view', with_numpy, memoryview),
+	('loop', loop_unmask, bytes),
+]
+
+def measure(func, buf, size, seconds):
+	"""Microseconds per call."""
+	timer = timeit.Timer(lambda: func(buf, HEADER, size))
+	number, taken = timer.autorange()
+	number = max(1, int(number * seconds / taken))
+	return min(timer.repeat(3, number)) / number * 1e6
+
+if __name__ == '__main__':
+	tornado.options.parse_command_line()
+	options = tornado.options.options
+
+	ways = [way for way in WAYS if websocket.numpy or not way[0].startswith('numpy')]
+	print("%10s" % "bytes" + ''.join("%12s" % name for name, func, wrap in ways) + "  (microseconds)")
+
+	default_min = websocket.WebSocketServer.numpy_unmask_min
+	for size in options.sizes:
+		data = frame(size)
+		expected = loop_unmask(data, HEADER, size)
+		times = []
+
+		for name, func, wrap in ways:
+			buf = wrap(data)
+			if func(buf, HEADER, size) != expected:
+				raise AssertionError("%s unmasked %d bytes wrongly" % (name, size))
+			# The byte loop takes seconds a call on the biggest payloads.
+			seconds = options.seconds if func is not loop_unmask else options.seconds / 4
+			times.append(measure(func, buf, size, seconds))
+
+		print("%10d" % size + ''.join("%12.1f" % t for t in times))
+
+	websocket.WebSocketServer.numpy_unmask_min = default_min
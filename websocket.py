@@ -17,7 +17,7 @@ as taken from http://docs.python.org/dev/library/ssl.html#certificates
 '''
 
 import os, sys, time, errno, signal, socket, traceback, select
-import array, struct
+import struct
 from base64 import b64encode, b64decode
 
 # Imports that vary by python version
@@ -64,6 +64,139 @@ if multiprocessing and sys.platform == 'win32':
     import multiprocessing.reduction
 
 
+class HybiFrame(object):
+    """ A frame FrameParser has read, or a whole message once the frames
+    it was fragmented into are joined. The parser hands out the same
+    object for every frame, so anything needed later has to be copied
+    out of it before asking for the next one. """
+
+    __slots__ = ('fin', 'opcode', 'masked', 'length', 'payload',
+                 'close_code', 'close_reason')
+
+
+class FrameParser(object):
+    """ Incremental HyBi frame parser.
+
+    Received data is appended to one buffer that frames are read out of
+    in place, rather than joined onto whatever was left over and sliced
+    again after every frame. Consumed bytes are only dropped from the
+    front once they are at least half the buffer, so each byte is moved
+    a bounded number of times however the stream is split into reads.
+
+    Fragmented messages come out whole, with the opcode of their first
+    frame. Control frames can arrive between fragments, and come out as
+    soon as they are read. Payloads are unmasked but not base64 decoded.
+
+    Payloads are always handed out as bytes of their own, even unmasked
+    ones that could be views into the buffer. Dropping consumed bytes
+    from the front of a bytearray raises BufferError while any view of
+    it is alive, and callers keep payloads past the next read, so one
+    copy per unmasked frame is the price of compacting in place. Masked
+    frames, which are all of them from browsers, need that copy anyway.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.start = 0
+        self.frame = HybiFrame()
+        # Payloads and opcode of a message whose final frame hasn't come.
+        self.fragments = []
+        self.fragment_opcode = None
+
+    def feed(self, data):
+        """ Add received bytes to the buffer. """
+        if self.start and self.start * 2 >= len(self.buf):
+            del self.buf[:self.start]
+            self.start = 0
+        self.buf += data
+
+    def pending(self):
+        """ Number of buffered bytes not yet read as a frame. """
+        return len(self.buf) - self.start
+
+    def next_frame(self):
+        """ Read one frame from the buffer, or return None if it doesn't
+        hold a whole one yet. """
+        buf, start = self.buf, self.start
+        avail = len(buf) - start
+
+        if avail < 2:
+            return None # Incomplete frame header
+
+        b1, b2 = unpack_from(">BB", buf, start)
+        masked = b2 >> 7
+        length = b2 & 0x7f
+        hlen = 2
+
+        if length == 126:
+            hlen = 4
+            if avail < hlen:
+                return None # Incomplete frame header
+            (length,) = unpack_from('>H', buf, start + 2)
+        elif length == 127:
+            hlen = 10
+            if avail < hlen:
+                return None # Incomplete frame header
+            (length,) = unpack_from('>Q', buf, start + 2)
+
+        pstart = start + hlen + masked * 4
+        if avail < pstart - start + length:
+            return None # Incomplete frame
+
+        f = self.frame
+        f.fin = b1 >> 7
+        f.opcode = b1 & 0x0f
+        f.masked = bool(masked)
+        f.length = length
+        f.close_code = 1000
+        f.close_reason = ''
+
+        if masked:
+            f.payload = WebSocketServer.unmask(buf, start + hlen, length)
+        else:
+            f.payload = bytes(buf[pstart:pstart + length])
+
+        self.start = pstart + length
+
+        if f.opcode == 0x08:
+            if length >= 2:
+                f.close_code = unpack_from(">H", f.payload)[0]
+            if length > 3:
+                f.close_reason = f.payload[2:]
+
+        return f
+
+    def frames(self):
+        """ Yield every whole message and control frame in the buffer. """
+        while True:
+            f = self.next_frame()
+            if f is None:
+                return
+
+            if f.opcode >= 0x08:
+                yield f
+            elif f.opcode == 0x00:
+                if self.fragment_opcode is None:
+                    raise WebSocketServer.CClose(1002,
+                            "Continuation frame outside a message")
+                self.fragments.append(f.payload)
+                if f.fin:
+                    f.opcode = self.fragment_opcode
+                    f.payload = s2b('').join(self.fragments)
+                    f.length = len(f.payload)
+                    self.fragments = []
+                    self.fragment_opcode = None
+                    yield f
+            elif self.fragment_opcode is not None:
+                raise WebSocketServer.CClose(1002,
+                        "New message before a fragmented one finished")
+            elif not f.fin:
+                self.fragment_opcode = f.opcode
+                self.fragments = [f.payload]
+            else:
+                yield f
+
+
 class WebSocketServer(object):
     """
     WebSockets server class.
@@ -239,38 +372,43 @@ Sec-WebSocket-Accept: %s\r
         os.dup2(os.open(os.devnull, os.O_RDWR), sys.stdout.fileno())
         os.dup2(os.open(os.devnull, os.O_RDWR), sys.stderr.fileno())
 
+    # Payloads at least this long are unmasked with numpy when it is
+    # available. Below it numpy's per call overhead costs more than it saves.
+    numpy_unmask_min = 1024
+
     @staticmethod
     def unmask(buf, hlen, plen):
+        """ Unmask the plen byte payload that follows the 4 byte mask at
+        buf[hlen]. buf can be bytes, a bytearray or a memoryview over
+        either; it is only read through a memoryview, so the payload isn't
+        copied out of it before being unmasked. """
+        view = memoryview(buf)
         pstart = hlen + 4
         pend = pstart + plen
-        if numpy:
-            b = c = s2b('')
-            if plen >= 4:
-                mask = numpy.frombuffer(buf, dtype=numpy.dtype('<u4'),
-                        offset=hlen, count=1)
-                data = numpy.frombuffer(buf, dtype=numpy.dtype('<u4'),
-                        offset=pstart, count=int(plen / 4))
-                #b = numpy.bitwise_xor(data, mask).data
-                b = numpy.bitwise_xor(data, mask).tostring()
+
+        if not plen:
+            return s2b('')
+
+        if numpy and plen >= WebSocketServer.numpy_unmask_min:
+            mask = numpy.frombuffer(view, dtype=numpy.dtype('<u4'),
+                    offset=hlen, count=1)
+            data = numpy.frombuffer(view, dtype=numpy.dtype('<u4'),
+                    offset=pstart, count=plen // 4)
+            b = numpy.bitwise_xor(data, mask).tobytes()
 
             if plen % 4:
-                #print("Partial unmask")
-                mask = numpy.frombuffer(buf, dtype=numpy.dtype('B'),
-                        offset=hlen, count=(plen % 4))
-                data = numpy.frombuffer(buf, dtype=numpy.dtype('B'),
-                        offset=pend - (plen % 4),
-                        count=(plen % 4))
-                c = numpy.bitwise_xor(data, mask).tostring()
-            return b + c
-        else:
-            # Slower fallback
-            mask = buf[hlen:hlen+4]
-            data = array.array('B')
-            mask = s2a(mask)
-            data.fromstring(buf[pstart:pend])
-            for i in range(len(data)):
-                data[i] ^= mask[i % 4]
-            return data.tostring()
+                mask = numpy.frombuffer(view, dtype=numpy.dtype('B'),
+                        offset=hlen, count=plen % 4)
+                data = numpy.frombuffer(view, dtype=numpy.dtype('B'),
+                        offset=pend - (plen % 4), count=plen % 4)
+                b += numpy.bitwise_xor(data, mask).tobytes()
+            return b
+
+        # XOR the whole payload in one go, as a single big integer against
+        # the mask repeated out to the payload's length.
+        key = (view[hlen:pstart].tobytes() * (plen // 4 + 1))[:plen]
+        data = int.from_bytes(view[pstart:pend], 'little')
+        return (data ^ int.from_bytes(key, 'little')).to_bytes(plen, 'little')
 
     @staticmethod
     def encode_hybi(buf, opcode, base64=False):
@@ -492,61 +630,67 @@ Sec-WebSocket-Accept: %s\r
             closed = {'code': 1000, 'reason': "Client closed abruptly"}
             return bufs, closed
 
+        if self.version.startswith("hybi"):
+            self.frame_parser.feed(buf)
+
+            for frame in self.frame_parser.frames():
+                if frame.opcode == 0x8: # connection close
+                    closed = {'code': frame.close_code,
+                              'reason': frame.close_reason}
+                    break
+
+                self.traffic("}")
+
+                if self.rec:
+                    self.rec.write("%s,\n" %
+                            repr("}%s}" % tdelta + b2s(frame.payload)))
+
+                payload = frame.payload
+                if self.base64 and frame.opcode in [1, 2]:
+                    try:
+                        payload = b64decode(payload)
+                    except:
+                        print("Exception while b64decoding buffer: %s" %
+                                repr(payload))
+                        raise
+
+                bufs.append(payload)
+
+            if not closed and self.frame_parser.pending():
+                # Incomplete/partial frame
+                self.traffic("}.")
+
+            return bufs, closed
+
         if self.recv_part:
             # Add partially received frames to current read buffer
             buf = self.recv_part + buf
             self.recv_part = None
 
         while buf:
-            if self.version.startswith("hybi"):
-
-                frame = self.decode_hybi(buf, base64=self.base64)
-                #print("Received buf: %s, frame: %s" % (repr(buf), frame))
-
-                if frame['payload'] == None:
-                    # Incomplete/partial frame
-                    self.traffic("}.")
-                    if frame['left'] > 0:
-                        self.recv_part = buf[-frame['left']:]
-                    break
-                else:
-                    if frame['opcode'] == 0x8: # connection close
-                        closed = {'code': frame['close_code'],
-                                  'reason': frame['close_reason']}
-                        break
-
-            else:
-                if buf[0:2] == s2b('\xff\x00'):
-                    closed = {'code': 1000,
-                              'reason': "Client sent orderly close frame"}
-                    break
+            if buf[0:2] == s2b('\xff\x00'):
+                closed = {'code': 1000,
+                          'reason': "Client sent orderly close frame"}
+                break
 
-                elif buf[0:2] == s2b('\x00\xff'):
-                    buf = buf[2:]
-                    continue # No-op
+            elif buf[0:2] == s2b('\x00\xff'):
+                buf = buf[2:]
+                continue # No-op
 
-                elif buf.count(s2b('\xff')) == 0:
-                    # Partial frame
-                    self.traffic("}.")
-                    self.recv_part = buf
-                    break
+            elif buf.count(s2b('\xff')) == 0:
+                # Partial frame
+                self.traffic("}.")
+                self.recv_part = buf
+                break
 
-                frame = self.decode_hixie(buf)
+            frame = self.decode_hixie(buf)
 
             self.traffic("}")
 
             if self.rec:
-                start = frame['hlen']
-                end = frame['hlen'] + frame['length']
-                if frame['masked']:
-                    recbuf = WebSocketServer.unmask(buf, frame['hlen'],
-                                                   frame['length'])
-                else:
-                    recbuf = buf[frame['hlen']:frame['hlen'] +
-                                               frame['length']]
                 self.rec.write("%s,\n" %
-                        repr("}%s}" % tdelta + recbuf))
-
+                        repr("}%s}" % tdelta + b2s(buf[frame['hlen']:
+                            frame['hlen'] + frame['length']])))
 
             bufs.append(frame['payload'])
 
@@ -772,6 +916,7 @@ Sec-WebSocket-Accept: %s\r
         # Initialize per client settings
         self.send_parts = []
         self.recv_part  = None
+        self.frame_parser = FrameParser()
         self.base64     = False
         self.rec        = None
         self.start_time = int(time.time()*1000)
@@ -0,0 +1,111 @@
+// Decoding messages from the server, see wire.py.
+
+// Websocket subprotocols to offer, in order of preference.
+var WIRE_SUBPROTOCOLS = ['munchkin.msgpack', 'munchkin.json'];
+
+var wire = (function() {
+	var utf8 = new TextDecoder('utf-8');
+
+	// Decode one MessagePack value from a DataView, starting at state.offset.
+	function unpack_value(view, state) {
+		var code = view.getUint8(state.offset++);
+
+		if( code < 0x80 ) {
+			return code;
+		} else if( code < 0x90 ) {
+			return unpack_map(view, state, code & 0x0f);
+		} else if( code < 0xa0 ) {
+			return unpack_array(view, state, code & 0x0f);
+		} else if( code < 0xc0 ) {
+			return unpack_str(view, state, code & 0x1f);
+		} else if( code >= 0xe0 ) {
+			return code - 0x100;
+		}
+
+		switch( code ) {
+			case 0xc0: return null;
+			case 0xc2: return false;
+			case 0xc3: return true;
+			case 0xc4: return unpack_bin(view, state, read(view, state, 'getUint8', 1));
+			case 0xc5: return unpack_bin(view, state, read(view, state, 'getUint16', 2));
+			case 0xc6: return unpack_bin(view, state, read(view, state, 'getUint32', 4));
+			case 0xca: return read(view, state, 'getFloat32', 4);
+			case 0xcb: return read(view, state, 'getFloat64', 8);
+			case 0xcc: return read(view, state, 'getUint8', 1);
+			case 0xcd: return read(view, state, 'getUint16', 2);
+			case 0xce: return read(view, state, 'getUint32', 4);
+			case 0xcf: return read_uint64(view, state);
+			case 0xd0: return read(view, state, 'getInt8', 1);
+			case 0xd1: return read(view, state, 'getInt16', 2);
+			case 0xd2: return read(view, state, 'getInt32', 4);
+			case 0xd3: return read_int64(view, state);
+			case 0xd9: return unpack_str(view, state, read(view, state, 'getUint8', 1));
+			case 0xda: return unpack_str(view, state, read(view, state, 'getUint16', 2));
+			case 0xdb: return unpack_str(view, state, read(view, state, 'getUint32', 4));
+			case 0xdc: return unpack_array(view, state, read(view, state, 'getUint16', 2));
+			case 0xdd: return unpack_array(view, state, read(view, state, 'getUint32', 4));
+			case 0xde: return unpack_map(view, state, read(view, state, 'getUint16', 2));
+			case 0xdf: return unpack_map(view, state, read(view, state, 'getUint32', 4));
+		}
+
+		throw new Error('Unknown MessagePack type 0x'+code.toString(16));
+	}
+
+	function read(view, state, getter, size) {
+		var value = view[getter](state.offset);
+		state.offset += size;
+		return value;
+	}
+
+	// Card ids are 48 bits, which a double holds exactly.
+	function read_uint64(view, state) {
+		var high = read(view, state, 'getUint32', 4);
+		return high * 0x100000000 + read(view, state, 'getUint32', 4);
+	}
+
+	function read_int64(view, state) {
+		var high = read(view, state, 'getInt32', 4);
+		return high * 0x100000000 + read(view, state, 'getUint32', 4);
+	}
+
+	function unpack_str(view, state, length) {
+		var bytes = new Uint8Array(view.buffer, view.byteOffset + state.offset, length);
+		state.offset += length;
+		return utf8.decode(bytes);
+	}
+
+	function unpack_bin(view, state, length) {
+		var bytes = view.buffer.slice(view.byteOffset + state.offset, view.byteOffset + state.offset + length);
+		state.offset += length;
+		return bytes;
+	}
+
+	function unpack_array(view, state, length) {
+		var array = new Array(length);
+		for( var i = 0; i < length; i++ ) {
+			array[i] = unpack_value(view, state);
+		}
+		return array;
+	}
+
+	// Keys become strings, as they would in json.
+	function unpack_map(view, state, length) {
+		var map = {};
+		for( var i = 0; i < length; i++ ) {
+			var key = unpack_value(view, state);
+			map[String(key)] = unpack_value(view, state);
+		}
+		return map;
+	}
+
+	return {
+		unpack: function(buffer) {
+			return unpack_value(new DataView(buffer), {offset: 0});
+		},
+
+		// A message event's data as an object, whichever format it came in.
+		decode: function(data) {
+			return typeof data == 'string' ? JSON.parse(data) : this.unpack(data);
+		}
+	};
+})();
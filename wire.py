@@ -0,0 +1,155 @@
+"""Encoding messages for the wire.
+
+Clients pick a format when they connect, by offering websocket subprotocols: munchkin.msgpack gets MessagePack
+in binary frames, anything else gets json in text frames. A Message is encoded at most once per format however
+many connections it goes to. MessagePack is only offered with the msgpack package installed: pack below gives
+the same bytes without it, but too slowly to be worth serving clients with.
+"""
+import json
+import struct
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+# Subprotocol -> format. MessagePack is only negotiated when the msgpack package is installed: pack on its own is
+# several times slower than json.dumps, and clients that offer it take json just as well.
+SUBPROTOCOLS = {
+	'munchkin.json': 'json',
+}
+if msgpack is not None:
+	SUBPROTOCOLS['munchkin.msgpack'] = 'msgpack'
+
+def is_binary(fmt):
+	return fmt != 'json'
+
+def _pack(obj, out):
+	if obj is None:
+		out.append(b'\xc0')
+	elif obj is True:
+		out.append(b'\xc3')
+	elif obj is False:
+		out.append(b'\xc2')
+	elif isinstance(obj, int):
+		if 0 <= obj < 0x80:
+			out.append(struct.pack('B', obj))
+		elif -32 <= obj < 0:
+			out.append(struct.pack('b', obj))
+		elif obj > 0:
+			out.append(_pack_int(obj, ((0xff, '>BB', 0xcc), (0xffff, '>BH', 0xcd), (0xffffffff, '>BI', 0xce)), '>BQ', 0xcf))
+		else:
+			out.append(_pack_int(-obj, ((0x80, '>Bb', 0xd0), (0x8000, '>Bh', 0xd1), (0x80000000, '>Bi', 0xd2)), '>Bq', 0xd3, obj))
+	elif isinstance(obj, float):
+		out.append(struct.pack('>Bd', 0xcb, obj))
+	elif isinstance(obj, str):
+		data = obj.encode('utf-8')
+		_pack_header(out, len(data), 0xa0, 32, 0xd9, 0xda, 0xdb)
+		out.append(data)
+	elif isinstance(obj, bytes):
+		_pack_header(out, len(obj), None, 0, 0xc4, 0xc5, 0xc6)
+		out.append(obj)
+	elif isinstance(obj, (list, tuple)):
+		_pack_header(out, len(obj), 0x90, 16, None, 0xdc, 0xdd)
+		for item in obj:
+			_pack(item, out)
+	elif isinstance(obj, dict):
+		_pack_header(out, len(obj), 0x80, 16, None, 0xde, 0xdf)
+		for key, value in obj.items():
+			_pack(key, out)
+			_pack(value, out)
+	else:
+		raise TypeError("Can't pack %r" % obj)
+
+def _pack_int(magnitude, sizes, wide_format, wide_code, value=None):
+	"""Pack an int in the smallest of sizes, (largest magnitude, struct format, type code) tuples, that holds it."""
+	value = magnitude if value is None else value
+	for limit, fmt, code in sizes:
+		if magnitude <= limit:
+			return struct.pack(fmt, code, value)
+	return struct.pack(wide_format, wide_code, value)
+
+def _pack_header(out, length, fix, fix_limit, code8, code16, code32):
+	if length < fix_limit:
+		out.append(struct.pack('B', fix | length))
+	elif code8 is not None and length <= 0xff:
+		out.append(struct.pack('BB', code8, length))
+	elif length <= 0xffff:
+		out.append(struct.pack('>BH', code16, length))
+	else:
+		out.append(struct.pack('>BI', code32, length))
+
+def pack(obj):
+	if msgpack is not None:
+		return msgpack.packb(obj, use_bin_type=True)
+
+	out = []
+	_pack(obj, out)
+	return b''.join(out)
+
+def map_header(length):
+	out = []
+	_pack_header(out, length, 0x80, 16, None, 0xde, 0xdf)
+	return out[0]
+
+def array_header(length):
+	out = []
+	_pack_header(out, length, 0x90, 16, None, 0xdc, 0xdd)
+	return out[0]
+
+ENCODERS = {
+	'json': json.dumps,
+	'msgpack': pack,
+}
+
+class Message(object):
+	"""A message to send, encoded at most once per format."""
+	__slots__ = ('obj', 'encoded')
+
+	def __init__(self, obj):
+		self.obj = obj
+		self.encoded = {}
+
+	def encode(self, fmt):
+		if fmt not in self.encoded:
+			self.encoded[fmt] = self.build(fmt)
+		return self.encoded[fmt]
+
+	def build(self, fmt):
+		return ENCODERS[fmt](self.obj)
+
+class Template(Message):
+	"""A message with one list field left out, to be filled with Messages that are each encoded only once.
+
+	fill puts the pieces together per format without encoding the rest of the message again.
+	"""
+	__slots__ = ('field',)
+
+	def __init__(self, obj, field):
+		super().__init__(obj)
+		self.field = field
+
+	def fill(self, items):
+		return Filled(self, items)
+
+	def build(self, fmt):
+		if fmt == 'json':
+			return json.dumps(self.obj)[:-1] + ', ' + json.dumps(self.field) + ': '
+
+		# The header counts the field, whose key is packed straight after the rest of the map.
+		return map_header(len(self.obj) + 1) + pack(self.obj)[len(map_header(len(self.obj))):] + pack(self.field)
+
+class Filled(Message):
+	__slots__ = ('template', 'items')
+
+	def __init__(self, template, items):
+		super().__init__(None)
+		self.template, self.items = template, items
+
+	def build(self, fmt):
+		head = self.template.encode(fmt)
+
+		if fmt == 'json':
+			return head + '[' + ', '.join(item.encode(fmt) for item in self.items) + ']}'
+
+		return head + array_header(len(self.items)) + b''.join(item.encode(fmt) for item in self.items)
@@ -0,0 +1,47 @@
+import random
+
+class Zone(object):
+	"""An ordered pile of cards, such as a deck, a player's hand or the cards in combat.
+
+	A card is in at most one zone at a time and keeps a reference to it in card.zone, so membership tests, removal
+	and moving a card between zones are all O(1). Appending a card takes it out of whatever zone it was in.
+	"""
+
+	def __init__(self, name, owner=None):
+		self.name, self.owner = name, owner
+		# dicts keep insertion order, the values are unused.
+		self.cards = {}
+
+	def append(self, card):
+		if card.zone is not None:
+			card.zone.remove(card)
+
+		self.cards[card] = None
+		card.zone = self
+
+	def extend(self, cards):
+		for card in list(cards):
+			self.append(card)
+
+	def remove(self, card):
+		del self.cards[card]
+		card.zone = None
+
+	def pop(self):
+		card, _ = self.cards.popitem()
+		card.zone = None
+		return card
+
+	def shuffle(self, rng=random):
+		cards = list(self.cards)
+		rng.shuffle(cards)
+		self.cards = dict.fromkeys(cards)
+
+	def __contains__(self, card):
+		return card.zone is self
+
+	def __iter__(self):
+		return iter(self.cards)
+
+	def __len__(self):
+		return len(self.cards)